@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+"""Benchmark the Logo interpreter on representative workloads.
+
+Usage: python3 bench/run.py [--engine=ENGINE] [--runs=N] [--save=FILE]
+                            [--compare=FILE] [--threshold=FRACTION] [NAME ...]
+
+Runs each workload in bench/workloads, and a parser workload, and prints a JSON
+report of the operations per second (the best of several runs), the spread of
+the runs, and the peak memory allocated by each.  A workload file declares the number of operations
+it performs in a "; ops: N" comment.  Turtle commands are applied to a backend
+that draws nothing.
+
+--save stores the report as a baseline.  --compare reads a baseline (default:
+bench/baseline.json), adds the change in each measurement to the report, and
+exits with status 1 if any workload is slower, or allocates more, than the
+baseline by more than the threshold fraction.  A workload whose runs vary is
+allowed to be slower by its spread, and the baseline's, as well.  A baseline is only compared
+with a report of the same engine and Python version: an explicit --compare
+with another is an error, and the default baseline is then skipped with a
+warning.  The committed baseline was measured with the tree engine.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import logo
+import logo_parser
+import logo_primitives
+
+WORKLOADS = os.path.join(ROOT, 'bench', 'workloads')
+BASELINE = os.path.join(ROOT, 'bench', 'baseline.json')
+
+# Changes in ops/sec or peak memory smaller than this fraction of the baseline
+# are not regressions.
+THRESHOLD = 0.25
+
+# The number of timed runs of each workload, of which the best is reported.
+RUNS = 10
+
+# Peak memory is compared as if it were at least this many KiB, so that small
+# workloads do not report noise as regressions.
+MEMORY_FLOOR = 64
+
+class NullStream(object):
+    """A file that discards everything written to it."""
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+class NullTurtle(object):
+    """A turtle graphics module whose functions do nothing."""
+    animated = False # Commands are not batched (see logo_turtle.Batch)
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+def logo_workload(path, engine):
+    """Return the number of operations in the Logo file at path and a function
+    that runs it in a new environment.  Errors are raised, not printed."""
+    with open(path) as f:
+        lines = f.read().splitlines()
+    ops = None
+    for line in lines:
+        match = re.match(r';\s*ops:\s*(\d+)', line)
+        if match:
+            ops = int(match.group(1))
+            break
+    if ops is None:
+        raise ValueError('{0} does not declare its ops'.format(path))
+    def run():
+        src = iter(lines)
+        output = logo.Output(NullStream(), limit=logo.OUTPUT_BUFFER)
+        continuation = logo.generate_lines(src, prompt='>', echo=False)
+        env = logo.Environment(continuation, logo.ENGINES[engine], output)
+        for line in src:
+            logo.interpret_line(logo.strip_comment(line), env)
+        output.flush()
+    return ops, run
+
+def parse_workload():
+    """Return the number of top-level tokens in long, distinct lines and a
+    function that parses them with the parse cache cleared."""
+    lines = ['print sum {0} difference :x{0} 3 [a "b [c {0} d] e] '
+             'ifelse :x > {0} [output -{0}] [fd {0}]'.format(i) * 20
+             for i in range(500)]
+    ops = sum(len(logo_parser.tokenize(line)) for line in lines)
+    def run():
+        logo_parser._parse_cached.cache_clear()
+        for line in lines:
+            logo_parser.parse_line(line)
+    return ops, run
+
+def workloads(engine):
+    """Return a dict mapping the name of each workload to its ops and run
+    function."""
+    found = {'parse': parse_workload()}
+    for path in sorted(glob.glob(os.path.join(WORKLOADS, '*.lg'))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        found[name] = logo_workload(path, engine)
+    return found
+
+def measure(ops, run, runs):
+    """Return the measurements of a workload: the best of runs timed runs, how
+    much slower than the best the median run was, as a fraction of the best,
+    and the peak memory allocated during one more."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    times.sort()
+    seconds = times[0]
+    return {'ops': ops, 'seconds': round(seconds, 6),
+            'ops_per_sec': round(ops / seconds, 1),
+            'spread': round(times[len(times) // 2] / seconds - 1, 3),
+            'peak_kib': round(peak / 1024, 1)}
+
+def python_release(version):
+    """Return the major and minor parts of a Python version string.
+
+    >>> python_release('3.11.7')
+    '3.11'
+    """
+    return '.'.join(version.split('.')[:2])
+
+def mismatch(report, baseline):
+    """Return why report cannot be compared with baseline, or None."""
+    if baseline.get('engine') != report['engine']:
+        return 'the baseline ran the {0} engine, not {1}'.format(
+            baseline.get('engine'), report['engine'])
+    release = python_release(report['python'])
+    if python_release(baseline.get('python', '')) != release:
+        return 'the baseline ran on Python {0}, not {1}'.format(
+            baseline.get('python'), report['python'])
+    return None
+
+def compare(report, baseline, threshold):
+    """Add the change from baseline to each workload in report, and return
+    descriptions of the regressions beyond threshold, or for ops/sec beyond
+    threshold plus the spreads of the workload and its baseline.  Raises
+    ValueError if baseline was measured with another engine or Python release.
+
+    >>> report = {'engine': 'tree', 'python': '3.11.7', 'workloads': {
+    ...     'fib': {'ops_per_sec': 60.0, 'spread': 0.05, 'peak_kib': 10}}}
+    >>> baseline = {'engine': 'tree', 'python': '3.11.2', 'workloads': {
+    ...     'fib': {'ops_per_sec': 100.0, 'spread': 0.02, 'peak_kib': 10}}}
+    >>> compare(report, baseline, 0.25)
+    ['fib: 40% fewer ops/sec']
+    >>> report['workloads']['fib']['spread'] = 0.2
+    >>> compare(report, baseline, 0.25)
+    []
+    """
+    problem = mismatch(report, baseline)
+    if problem is not None:
+        raise ValueError('Cannot compare: ' + problem)
+    regressions = []
+    for name, result in sorted(report['workloads'].items()):
+        base = baseline.get('workloads', {}).get(name)
+        if base is None:
+            continue
+        speed = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        memory = (max(result['peak_kib'], MEMORY_FLOOR) /
+                  max(base['peak_kib'], MEMORY_FLOOR) - 1)
+        result['ops_per_sec_change'] = round(speed, 3)
+        result['peak_kib_change'] = round(memory, 3)
+        noise = result.get('spread', 0) + base.get('spread', 0)
+        if speed < -(threshold + noise):
+            regressions.append('{0}: {1:.0%} fewer ops/sec'.format(
+                name, -speed))
+        if memory > threshold:
+            regressions.append('{0}: {1:.0%} more peak memory'.format(
+                name, memory))
+    report['regressions'] = regressions
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('names', nargs='*', metavar='NAME',
+                        help='workloads to run (default: all)')
+    parser.add_argument('--engine', choices=sorted(logo.ENGINES),
+                        default='tree', help='the engine that runs Logo')
+    parser.add_argument('--runs', type=int, default=RUNS,
+                        help='number of runs, of which the best is reported '
+                             '(default: %(default)s)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='write the report to FILE as a baseline')
+    parser.add_argument('--compare', metavar='FILE', default=None,
+                        help='compare with the baseline report in FILE '
+                             '(default: bench/baseline.json, if it exists)')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='the fraction by which a workload may be worse '
+                             'than the baseline (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    baseline, path = None, args.compare or BASELINE
+    if args.compare or os.path.exists(BASELINE): # Read before it is replaced
+        with open(path) as f:
+            baseline = json.load(f)
+
+    logo_primitives.turtle = NullTurtle()
+    available = workloads(args.engine)
+    names = args.names or sorted(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        parser.error('unknown workloads: ' + ' '.join(unknown))
+    report = {'engine': args.engine, 'python': platform.python_version(),
+              'runs': args.runs, 'workloads': {}}
+    for name in names:
+        report['workloads'][name] = measure(*available[name], runs=args.runs)
+
+    if args.save: # Before the changes from the baseline are added
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+    regressions = []
+    if baseline is not None:
+        try:
+            regressions = compare(report, baseline, args.threshold)
+        except ValueError as e:
+            if args.compare:
+                parser.error('{0} ({1})'.format(e, path))
+            sys.stderr.write('Warning: {0} ({1})\n'.format(e, path))
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    for regression in regressions:
+        sys.stderr.write('Regression: ' + regression + '\n')
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""Benchmark the startup of the Logo interpreter.
+
+Usage: python3 bench/startup.py [--runs=N]
+
+Reports the best time to import the logo module in a fresh Python process,
+whether that import also imported turtle graphics, and the time to create an
+Environment.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+IMPORT_LOGO = """
+import sys, time
+start = time.perf_counter()
+import logo
+print(time.perf_counter() - start, 'turtle' in sys.modules)
+"""
+
+def time_import(runs):
+    """Return the best time to import logo in a new process, and whether it
+    imported turtle."""
+    times, turtle = [], False
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', IMPORT_LOGO],
+                                      cwd=ROOT, universal_newlines=True)
+        seconds, imported = out.split()
+        times.append(float(seconds))
+        turtle = turtle or imported == 'True'
+    return min(times), turtle
+
+def time_environment(runs):
+    """Return the best time to create an Environment."""
+    import logo
+    number = 1000
+    timer = timeit.Timer(logo.Environment)
+    return min(timer.repeat(runs, number)) / number
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=9,
+                        help='number of runs, of which the best is reported')
+    args = parser.parse_args(argv)
+    seconds, turtle = time_import(args.runs)
+    print('import logo    {0:8.2f} ms  (turtle imported: {1})'.format(
+        seconds * 1e3, 'yes' if turtle else 'no'))
+    print('Environment()  {0:8.2f} us'.format(
+        time_environment(args.runs) * 1e6))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,10 +1,21 @@
 """A Logo interpreter."""
 
+import argparse
+import collections
+import os
+import signal
 import sys
-from ucb import interact, main, trace
+import time
 from buffer import Buffer
-from logo_parser import parse_line
+from logo_lists import islist
+from logo_parser import make_token, parse_line, Token, Number, Quoted, Variable
+import logo_closure
+import logo_compiler
+from logo_core import LogoError, PRIMITIVES, Procedure, error, isoutput
+import logo_memo
 import logo_primitives
+import logo_profiler
+import logo_vm
 
 try:
     import readline
@@ -19,11 +30,11 @@ def eval_line(line, env):
 
     >>> line = Buffer(parse_line('1 2'))
     >>> eval_line(line, Environment())
-    '1'
+    1
     >>> line = Buffer(parse_line('print 1 2'))
     >>> eval_line(line, Environment())
     1
-    '2'
+    2
     """
     result = None
     while line.current is not None and result is None:
@@ -35,15 +46,15 @@ def logo_eval(line, env, pre_operator=False):
 
     >>> line = Buffer(parse_line('sum 1 (sum 2 3)'))
     >>> eval_line(line, Environment())
-    '6'
+    6
     >>> line = Buffer(parse_line('sum 1 (sum 2 3 4)'))
     >>> eval_line(line, Environment())
     Traceback (most recent call last):
         ...
-    logo.LogoError: Expected ")" at [ sum, 1, (, sum, 2, 3 >> 4, ) ]
+    logo_core.LogoError: Expected ")" at [ sum, 1, (, sum, 2, 3 >> 4, ) ]
     >>> line = Buffer(parse_line('3 + 12 / 8 - 0.25 * 2 = 2 * ( 1 + 0.5 ) * 4 / 3'))
     >>> eval_line(line, Environment())
-    'True'
+    True
     """
     if line.current == None:
         error('Ran out of input at {0}'.format(line))
@@ -53,7 +64,7 @@ def logo_eval(line, env, pre_operator=False):
     def eval_noninfix(line, env):
         token = line.pop()
         if isprimitive(token):
-            return token
+            return primitive_value(token)
         elif isvariable(token):
             return env.lookup_variable(variable_name(token))
         elif isdefinition(token):
@@ -72,7 +83,7 @@ def logo_eval(line, env, pre_operator=False):
                 error('I do not know how to {0}.'.format(token))
             return apply_procedure(procedure, line, env)
     result = eval_noninfix(line, env)
-    while not isinstance(line.current, list) and line.current in INFIX_SYMBOLS:
+    while not islist(line.current) and line.current in INFIX_SYMBOLS:
         operator = line.current
         proc= env.procedures.get(INFIX_SYMBOLS[operator], None)
         if operator in INFIX_GROUPS[2]:
@@ -105,11 +116,11 @@ def collect_args(n, line, env):
     >>> line = Buffer(parse_line('2 sum 3 4'))
     >>> env = Environment()
     >>> collect_args(2, line, env)
-    ['2', '7']
+    [2, 7]
     >>> collect_args(1, line, env)
     Traceback (most recent call last):
         ...
-    logo.LogoError: Found only 0 of 1 args at [ 2, sum, 3, 4 >>  ]
+    logo_core.LogoError: Found only 0 of 1 args at [ 2, sum, 3, 4 >>  ]
     """
     args = []
     while line.current is not None and len(args) < n:
@@ -123,10 +134,10 @@ def logo_apply(proc, args):
 
     >>> body = [['show', ':x'], ['output', 'sum', '1', ':x', ')'], [')']]
     >>> proc = Procedure('f', 1, body, needs_env=True, formal_params=['x'])
-    >>> args = ['4', Environment()]
+    >>> args = [4, Environment()]
     >>> logo_apply(proc, args)
     4
-    '5'
+    5
     """
     if proc.isprimitive:
         try:
@@ -134,25 +145,74 @@ def logo_apply(proc, args):
         except Exception as e:
             error(e) # Convert any error into a LogoError
     else:
-        args_dict = dict(zip(proc.formal_params, args[:-1]))
-        args[-1].push_frame(args_dict)
-        for i in proc.body:
-            result = eval_line(Buffer(i), args[-1])
-            if result is not None and result[0] == 'OUTPUT':
-                args[-1].pop_frame()
-                return result[1]
-            elif result is not None:
-                args[-1].pop_frame()
-                return error("You do not say what to do with {0}".format(result))
+        env = args[-1]
+        if env.engine is not None:
+            apply = env.engine.apply_procedure
+        else:
+            apply = apply_user_procedure
+        if proc.memo is not None:
+            return logo_memo.call(apply, proc, args[:-1], env)
+        return apply(proc, args[:-1], env)
+
+def apply_user_procedure(proc, args, env):
+    """Apply a user-defined procedure to a list of argument values by
+    evaluating its expression trees."""
+    # Calls in tail position are returned by the body as a PendingCall and
+    # made by this loop, so they do not nest Python calls.
+    frames, must_not_output, stores = 0, False, []
+    try:
+        while True:
+            env.push_frame(dict(zip(proc.formal_params, args)), proc)
+            frames += 1
+            result = run_body(proc, env)
+            if type(result) is not logo_compiler.PendingCall:
+                break
+            must_not_output = must_not_output or not result.output
+            if result.proc.memo is not None: # Its output may be cached
+                value, store = logo_memo.lookup(result.proc, result.args)
+                if value is not logo_memo.MISSING:
+                    result = value
+                    break
+                if store is not None: # Cached once the loop ends
+                    stores.append(store)
+            if result.replace_frame:
+                env.pop_frame()
+                frames -= 1
+            proc, args = result.proc, result.args
+    finally:
+        for _ in range(frames):
+            env.pop_frame()
+    if must_not_output and result is not None:
+        error("You do not say what to do with {0}".format(
+            logo_primitives.words_of(result)))
+    for memo, key, generation in stores:
+        memo.put(key, result, generation)
+    return result
 
-def isoutput(result):
-    """Return whether result is a two-element tuple starting with 'OUTPUT'."""
-    length_two = type(result) == tuple and len(result) == 2
-    return length_two and result[0] == 'OUTPUT'
+def run_body(proc, env):
+    """Evaluate the body of a user-defined procedure in env, returning its
+    output, None, or a call in tail position as a PendingCall."""
+    code = proc.code
+    if code is None:
+        code = logo_compiler.compile_procedure(proc, env)
+    for index in range(len(code)):
+        if proc.code is not code: # Redefinitions invalidated the body
+            code = logo_compiler.compile_procedure(proc, env)
+        result = logo_compiler.run_block(code[index], env)
+        if result is not None:
+            if isoutput(result):
+                return result[1]
+            elif type(result) is logo_compiler.PendingCall:
+                return result
+            error("You do not say what to do with {0}".format(
+                logo_primitives.words_of(result)))
+    return None
 
 def isprimitive(token):
     """Numbers, True, and False are primitive, self-evaluating tokens."""
-    if token in ('True', 'False'):
+    if isinstance(token, Token): # The lexer has already classified it
+        return type(token) is Number or token in ('True', 'False')
+    if token in ('True', 'False') or type(token) in (int, float, bool):
         return True
     try:
         float(token)
@@ -160,13 +220,34 @@ def isprimitive(token):
     except (TypeError, ValueError):
         return False
 
+def primitive_value(token):
+    """Return the value of a primitive token: a number, True, False, or the
+    text of a number that would not print as written.
+
+    >>> [primitive_value(token) for token in parse_line('3 2.5 007 True')]
+    [3, 2.5, '007', True]
+    """
+    if type(token) is Number:
+        return token.value
+    elif token == 'True':
+        return True
+    elif token == 'False':
+        return False
+    elif isinstance(token, str):
+        return make_token(token).value
+    return token
+
 def isvariable(exp):
     """Variables start with ":" """
-    return type(exp) == str and exp.startswith(':')
+    if isinstance(exp, Token):
+        return type(exp) is Variable
+    return isinstance(exp, str) and exp.startswith(':')
 
 def variable_name(exp):
     """Variable names follow the ":" """
-    if type(exp) != str or len(exp) <= 1 or exp[0] != ':':
+    if type(exp) is Variable and exp.name:
+        return exp.name
+    if not isinstance(exp, str) or len(exp) <= 1 or exp[0] != ':':
         raise ValueError('Illegal variable expression {0}'.format(exp))
     return exp[1:]
 
@@ -184,7 +265,9 @@ def isquoted(exp):
     >>> isquoted([1, 2])
     True
     """
-    if isinstance(exp, list) or exp.startswith('"'):
+    if isinstance(exp, Token):
+        return type(exp) is Quoted
+    if islist(exp) or isinstance(exp, str) and exp.startswith('"'):
         return True
     return False
 
@@ -196,6 +279,8 @@ def text_of_quotation(exp):
     >>> text_of_quotation([1, 2])
     [1, 2]
     """
+    if type(exp) is Quoted:
+        return exp.text
     if isinstance(exp, str):
         return exp[1:]
     return exp
@@ -204,42 +289,33 @@ def text_of_quotation(exp):
 # Primitive Procedures #
 ########################
 
-def logo_type(x, top_level=True):
+def render(x, top_level=True):
+    """Return the text that prints a value x, rendering each element once.
+
+    >>> render([1, '2', ['3', [], ['4'], 5.0], '2'])
+    '1 2 [3 [] [4] 5.0] 2'
+    """
+    if not islist(x):
+        return str(x)
+    text = ' '.join([render(i, False) for i in x])
+    if top_level:
+        return text
+    return '[' + text + ']'
+
+def logo_type(x, env):
     """Apply the "type" primitive, which prints out a value x.
 
-    >>> logo_type(['1', '2', ['3', ['4'], '5']])
-    1 2 [3 [4] 5]
+    >>> logo_type([1, '2', ['3', ['4'], 5.0]], Environment())
+    1 2 [3 [4] 5.0]
     >>> line = Buffer(parse_line('type [a [b c] d]'))
     >>> eval_line(line, Environment())
     a [b c] d
     """
-    if type(x) != list:
-        print(x, end='') # The end argument prevents starting a new line
-    else:
-        print_str = ""
-        if not top_level:
-            print_str += '['
-        for i in x:
-            if isinstance(i, list):
-                print(print_str, end='')
-                logo_type(i, False)
-                print_str = " "
-            else:
-                if x[-1] == i:
-                    print_str += i
-                else:
-                    print_str += "{0} ".format(i)
-        if not top_level:
-            if print_str == ' ':
-                print_str = ']'
-            else:
-                print_str += ']'
-        if print_str != ' ':
-            print(print_str, end='')
+    env.output.write(render(x))
 
 def logo_run(exp, env):
     """Apply the "run" primitive."""
-    if type(exp) != list:
+    if not islist(exp):
         exp = [exp]
     return eval_line(Buffer(exp), env)
 
@@ -257,17 +333,17 @@ def logo_if(val, exp, env):
     >>> logo_if(valnone, exp, env)
     Traceback (most recent call last):
     ...
-    logo.LogoError: First argument to 'if' is not True or False: 1
+    logo_core.LogoError: First argument to "if" is not True or False: 1
     """
-    if type(val) != list:
+    if not islist(val):
         val = [val]
     result = eval_line(Buffer(val), env)
-    if result == 'True':
-        return eval_line(Buffer(exp), env)
-    elif result == 'False':
+    if result is True or result == 'True':
+        return eval_line(Buffer(logo_primitives.to_sequence(exp)), env)
+    elif result is False or result == 'False':
         return
     else:
-        error("First argument to 'if' is not True or False: {0}".format(result))
+        error('First argument to "if" is not True or False: {0}'.format(result))
 
 def logo_ifelse(val, true_exp, false_exp, env):
     """Apply the "ifelse" primitive, which takes a boolean and two lists.
@@ -285,17 +361,26 @@ def logo_ifelse(val, true_exp, false_exp, env):
     >>> logo_ifelse(valnone, true_exp, false_exp, env)
     Traceback (most recent call last):
     ...
-    logo.LogoError: First argument to 'ifelse' is not True or False: 1
+    logo_core.LogoError: First argument to "ifelse" is not True or False: 1
     """
-    if type(val) != list:
+    if not islist(val):
         val = [val]
     result = eval_line(Buffer(val), env)
-    if result == 'True':
-        return eval_line(Buffer(true_exp), env)
-    elif result == 'False':
-        return eval_line(Buffer(false_exp), env)
+    if result is True or result == 'True':
+        return eval_line(Buffer(logo_primitives.to_sequence(true_exp)), env)
+    elif result is False or result == 'False':
+        return eval_line(Buffer(logo_primitives.to_sequence(false_exp)), env)
     else:
-        error("First argument to 'ifelse' is not True or False: {0}".format(result))
+        error('First argument to "ifelse" is not True or False: {0}'.format(
+            result))
+
+def logo_output(x):
+    """Apply the "output" primitive, which returns x from a procedure."""
+    return ('OUTPUT', x)
+
+def logo_stop():
+    """Apply the "stop" primitive, which returns from a procedure."""
+    return ('OUTPUT', None)
 
 def logo_make(symbol, val, env):
     """Apply the Logo make primitive, which binds a name to a value.
@@ -304,10 +389,90 @@ def logo_make(symbol, val, env):
     >>> env = Environment(None)
     >>> eval_line(line, env)
     >>> env.lookup_variable('2')
-    '3'
+    3
     """
     env.set_variable_value(symbol, val)
 
+def logo_memoize(name, env):
+    """Apply the "memoize" primitive, which caches the outputs of a procedure.
+
+    Later calls with the same arguments output the cached value without
+    evaluating the body, so memoized procedures should have no side effects.
+
+    >>> env = Environment()
+    >>> body = iter(['output :n * :n', 'end'])
+    >>> env.get_continuation_line = lambda: next(body)
+    >>> eval_line(Buffer(parse_line('to square :n')), env)
+    >>> for line in ['memoize "square', 'print square 3', 'print square 3']:
+    ...     eval_line(Buffer(parse_line(line)), env)
+    9
+    9
+    >>> eval_line(Buffer(parse_line('memostats "square')), env)
+    [1, 1, 1]
+    """
+    find_user_procedure(name, env).memo = logo_memo.Memo()
+
+def logo_unmemoize(name, env):
+    """Apply the "unmemoize" primitive, which discards the cached outputs of a
+    procedure and stops caching them."""
+    find_user_procedure(name, env).memo = None
+
+def logo_memostats(name, env):
+    """Apply the "memostats" primitive, which outputs the numbers of cache
+    hits, cache misses, and cached outputs of a memoized procedure."""
+    memo = find_user_procedure(name, env).memo
+    if memo is None:
+        error('{0} is not memoized'.format(name))
+    return [memo.hits, memo.misses, len(memo.outputs)]
+
+def logo_profile(exp, env):
+    """Apply the "profile" primitive, which evaluates the line exp and prints
+    how many times each procedure was called and how long each took.  Within a
+    profiled program, it just evaluates the line."""
+    if env.profiler is not None:
+        return run_line(exp, env)
+    profiler = logo_profiler.start(env)
+    try:
+        result = run_line(exp, env)
+    finally:
+        logo_profiler.stop(env)
+    env.output.write(profiler.report() + '\n')
+    return result
+
+def logo_sample(path, env):
+    """Apply the "sample" primitive, which starts sampling the procedures being
+    applied, to write folded stacks to the file path when sampling stops."""
+    logo_profiler.start_sampling(env, logo_primitives.to_word(path))
+
+def logo_unsample(env):
+    """Apply the "unsample" primitive, which stops sampling and writes the
+    folded stacks."""
+    logo_profiler.stop_sampling(env)
+
+def logo_sampleinterval(ms, env):
+    """Apply the "sampleinterval" primitive, which sets the number of
+    milliseconds between samples taken by later uses of "sample"."""
+    interval = logo_primitives.to_num(ms) / 1000
+    if interval <= 0:
+        error('The sample interval must be positive')
+    env.sample_interval = interval
+
+def run_line(exp, env):
+    """Evaluate a list or word exp as a line with the engine of env."""
+    tokens = logo_primitives.to_sequence(exp)
+    if env.engine is not None:
+        return env.engine.eval_line(tokens, env)
+    return eval_line(Buffer(tokens), env)
+
+def find_user_procedure(name, env):
+    """Return the user-defined procedure called name, or raise an error."""
+    proc = env.procedures.get(name, None)
+    if proc is None:
+        error('I do not know how to {0}.'.format(name))
+    elif proc.isprimitive:
+        error('{0} is a primitive procedure'.format(name))
+    return proc
+
 # A dict mapping infix symbols to Logo primitive procedure names.
 INFIX_SYMBOLS = {'+': 'sum',
                  '-': 'difference',
@@ -325,39 +490,6 @@ INFIX_GROUPS = [['<', '>', '='], ['+', '-'], ['*', '/']]
 # Procedures and Initialization #
 #################################
 
-class Procedure(object):
-    """A Logo procedure, either primitive or user-defined.
-
-    name: The name of the procedure.  For primitive procedures with multiple
-          names, only one is stored here.
-
-    arg_count: Number of arguments required by the procedure.
-
-    body: A Logo procedure body is either:
-            a Python function, if isprimitive == True
-            a list of lines,   if isprimitive == False
-
-    isprimitive: whether the procedure is primitive.
-
-    needs_env: whether the environment should be passed as an add'l parameter.
-
-    formal_params: list of formal parameter names (user-defined procedures).
-    """
-    def __init__(self, name, arg_count, body, isprimitive=False,
-                 needs_env=False, formal_params=None):
-        self.name = name
-        self.arg_count = arg_count
-        self.body = body
-        self.isprimitive = isprimitive
-        self.needs_env = needs_env
-        if not formal_params:
-            formal_params = [str(i) for i in range(arg_count)]
-        self.formal_params = formal_params
-
-    def __str__(self):
-        params = ' '.join([':'+p for p in self.formal_params])
-        return 'to {0} {1}'.format(self.name, params)
-
 def load_primitives():
     """Load primitive Logo procedures."""
     primitives = dict()
@@ -372,35 +504,261 @@ def load_primitives():
             primitives[name] = procedure
 
     logo_primitives.load(make_primitive)
-    make_primitive('type', 1, logo_type)
+    make_primitive('type', 1, logo_type, needs_env=True)
     make_primitive('make', 2, logo_make, needs_env=True)
     make_primitive('if', 2, logo_if, needs_env=True)
     make_primitive('ifelse', 3, logo_ifelse, needs_env=True)
 
-    make_primitive('output', 1, lambda x: ('OUTPUT', x))
-    make_primitive('stop', 0, lambda: ('OUTPUT', None))
+    make_primitive('output', 1, logo_output, pure=True)
+    make_primitive('stop', 0, logo_stop, pure=True)
     make_primitive('run', 1, logo_run, needs_env=True)
+
+    make_primitive('memoize', 1, logo_memoize, needs_env=True)
+    make_primitive('unmemoize', 1, logo_unmemoize, needs_env=True)
+    make_primitive('memostats', 1, logo_memostats, needs_env=True)
+    make_primitive('profile', 1, logo_profile, needs_env=True)
+    make_primitive('sample', 1, logo_sample, needs_env=True)
+    make_primitive('unsample', 0, logo_unsample, needs_env=True)
+    make_primitive('sampleinterval', 1, logo_sampleinterval, needs_env=True)
     return primitives
 
+def primitives():
+    """Return PRIMITIVES, loading the primitive procedures the first time.
+    They are loaded when the first Environment is created, rather than when
+    logo is imported, so that the modules that define primitives can import
+    logo first."""
+    if not PRIMITIVES:
+        PRIMITIVES.update(load_primitives())
+    return PRIMITIVES
 
 ############################################
 # Environments and User-Defined Procedures #
 ############################################
 
+# The default limit on the depth of calls in the bytecode engine.
+MAX_DEPTH = 500000
+
+# The number of characters that a buffered Output collects before writing.
+OUTPUT_BUFFER = 1 << 16
+
+# The number of evaluation steps between the checks of an environment's limits,
+# each of which is a yield point (see Environment.step).
+SLICE_STEPS = 1000
+
+class Output(object):
+    """A sink for the text that Logo programs print.
+
+    A buffered Output collects text and writes it to its stream in one piece
+    when limit characters have been collected or when it is flushed.  An
+    unbuffered one writes text as soon as it is printed.
+
+    stream: a file to write to, or None to write to sys.stdout (looked up when
+            writing, so that output can be redirected after it is created).
+
+    >>> out = Output(limit=OUTPUT_BUFFER)
+    >>> out.write('1 2')
+    >>> out.write(' 3\\n')
+    >>> out.flush()
+    1 2 3
+    """
+    def __init__(self, stream=None, limit=0):
+        self.stream = stream
+        self.limit = limit
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        """Print text, which is written once enough has been collected."""
+        if not self.limit:
+            (self.stream or sys.stdout).write(text)
+            return
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.limit:
+            self._drain()
+
+    def _drain(self):
+        if self._parts:
+            text = ''.join(self._parts)
+            self._parts, self._size = [], 0
+            (self.stream or sys.stdout).write(text)
+
+    def flush(self):
+        """Write all collected text and flush the stream."""
+        self._drain()
+        (self.stream or sys.stdout).flush()
+
+# Saved by push_frame for a name that was bound only in the global frame, if
+# at all, so that pop_frame restores its current global value.
+_GLOBAL = object()
+
 class Environment(object):
-    """An environment holds procedure (global) and name bindings in frames."""
-    def __init__(self, get_continuation_line=None):
+    """An environment holds procedure (global) and name bindings in frames.
+
+    Variables are shallow bound: the current value of every name is kept in a
+    single table, so looking one up takes the same time at any depth of calls.
+    Pushing a frame saves the values that it shadows, and popping the frame
+    restores them.
+
+    engine: a module that evaluates lines and applies user-defined procedures
+            (see ENGINES), or None to evaluate them as expression trees.
+
+    max_depth: the number of nested calls that the bytecode and closure
+               engines allow before raising a "Stack overflow" error.
+
+    auto_memoize: whether pure procedures are memoized when they are compiled.
+
+    output: the Output to which print, show, and type write.
+
+    profiler: the Profiler that times the procedures of this environment, or
+              None (see logo_profiler).
+
+    sampler: the Sampler that samples the call stacks of this environment, or
+             None (see logo_profiler).
+
+    sample_interval: the number of seconds between samples.
+
+    step_limit: the number of steps that a line read by the read-eval loop may
+                take, or None.  A step is a call of a user-defined procedure
+                or an iteration of a loop.
+
+    time_limit: the number of seconds that a line may run, or None.
+
+    yield_hook: a function called with the environment after each slice_steps
+                steps, at which a scheduler may run other programs, or None.
+    """
+    def __init__(self, get_continuation_line=None, engine=None, output=None):
         self.get_continuation_line = get_continuation_line
-        self.procedures = load_primitives()
-        self._frames = [dict()] # The first frame is the global one
+        self.engine = engine
+        self.max_depth = MAX_DEPTH
+        self.auto_memoize = False
+        self.output = output or Output()
+        self.procedures = primitives() # Copied before the first definition
+        self.dependents = dict() # Maps names to procedures compiled using them
+        self.templates = collections.OrderedDict() # See procedure_of
+        self.repcount = -1 # The count of the innermost repeat, if any
+        self.profiler = None
+        self.sampler = None
+        self.sample_interval = logo_profiler.SAMPLE_INTERVAL
+        self.step_limit = None
+        self.time_limit = None
+        self.yield_hook = None
+        self.slice_steps = SLICE_STEPS
+        self.steps = 0 # Steps taken by the current line before this slice
+        self.deadline = None # The time.monotonic() at which the line must end
+        self._slice = self._countdown = SLICE_STEPS # Steps in, left in slice
+        self._globals = dict()
+        self._frames = [self._globals] # The first frame is the global one
+        self._bindings = dict() # Maps names to their current values
+        self._saved = [] # Values shadowed by each frame after the first
+        self._shadows = dict() # Maps names to how many frames bind them
+        self._calls = [] # The procedure called by each frame after the first
+
+    def define_procedure(self, name, proc):
+        """Bind name to proc, invalidating compiled code that looked it up
+        and the memoized outputs of procedures that might call it."""
+        if self.procedures is PRIMITIVES:
+            self.procedures = dict(PRIMITIVES)
+        self.procedures[name] = proc
+        logo_memo.forget(name, self)
+        for dependent in self.dependents.pop(name, ()):
+            dependent.invalidate()
+
+    def start_line(self):
+        """Start counting the steps and time taken by a line."""
+        self.steps = 0
+        self.deadline = None
+        if self.time_limit is not None:
+            self.deadline = time.monotonic() + self.time_limit
+        self._start_slice()
+
+    def _start_slice(self):
+        size = self.slice_steps
+        if self.step_limit is not None: # Check just after the last step
+            size = max(1, min(size, self.step_limit - self.steps + 1))
+        self._slice = self._countdown = size
+
+    def step(self, n=1):
+        """Count n steps, checking the limits after each slice of steps.
+        Primitives that apply a procedure to each element of a list count a
+        step for each element, and may count those of a chunk at once.
 
-    def push_frame(self, frame):
-        """Add a new frame, which contains new bindings."""
+        >>> env = Environment()
+        >>> env.step_limit = 2500
+        >>> env.start_line()
+        >>> for _ in range(2500):
+        ...     env.step()
+        >>> env.step()
+        Traceback (most recent call last):
+            ...
+        logo_core.LogoError: Stopped after 2500 steps
+        """
+        self._countdown -= n
+        if self._countdown <= 0:
+            self.check_limits()
+
+    def check_limits(self):
+        """Count the steps of the slice that ended, raise a LogoError if a
+        limit is exceeded, and yield to the yield_hook."""
+        self.steps += self._slice - self._countdown
+        self._start_slice()
+        if self.step_limit is not None and self.steps > self.step_limit:
+            error('Stopped after {0} steps'.format(self.step_limit))
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            error('Stopped after {0} seconds'.format(self.time_limit))
+        if self.yield_hook is not None:
+            self.yield_hook(self)
+
+    def push_frame(self, frame, proc=None):
+        """Add a new frame, which contains new bindings for a call to proc or
+        for a loop (if proc is None).  A call counts as a step."""
+        if proc is not None:
+            self._countdown -= 1
+            if self._countdown <= 0:
+                self.check_limits()
+        bindings, shadows, saved = self._bindings, self._shadows, {}
+        for name in frame:
+            if name in shadows:
+                saved[name] = bindings[name]
+                shadows[name] += 1
+            else:
+                saved[name] = _GLOBAL
+                shadows[name] = 1
+        bindings.update(frame)
         self._frames.append(frame)
+        self._saved.append(saved)
+        self._calls.append(proc)
 
     def pop_frame(self):
         """Discard the last frame."""
         self._frames.pop()
+        self._calls.pop()
+        bindings, shadows = self._bindings, self._shadows
+        for name, value in self._saved.pop().items():
+            if value is _GLOBAL:
+                del shadows[name]
+                if name in self._globals:
+                    bindings[name] = self._globals[name]
+                else:
+                    del bindings[name]
+            else:
+                shadows[name] -= 1
+                bindings[name] = value
+
+    def depth(self):
+        """Return the number of frames pushed for calls and loops."""
+        return len(self._calls)
+
+    def call_stack(self):
+        """Return the names of the procedures being applied, outermost first.
+
+        >>> env = Environment()
+        >>> env.push_frame({'n': 1}, PRIMITIVES['sum'])
+        >>> env.push_frame({'i': 1})
+        >>> env.call_stack()
+        ['sum']
+        """
+        return [proc.name for proc in list(self._calls) if proc is not None]
 
     def lookup_variable(self, symbol):
         """Look up a variable in the environment, or raise an error.
@@ -416,12 +774,11 @@ class Environment(object):
         >>> env.lookup_variable('z')
         Traceback (most recent call last):
             ...
-        logo.LogoError: z has no value
+        logo_core.LogoError: z has no value
         """
-        for i in range(len(self._frames)-1, -1, -1):
-            if symbol in self._frames[i].keys():
-                return self._frames[i][symbol]
-        else:
+        try:
+            return self._bindings[symbol]
+        except KeyError:
             error("{0} has no value".format(symbol))
 
     def set_variable_value(self, symbol, val):
@@ -442,11 +799,29 @@ class Environment(object):
         1
         >>> env.lookup_variable('z')
         5
+
+        The frame of a loop variable does not hide the frame of the procedure
+        that the loop is in.
+
+        >>> env.push_frame({'x': 2}, PRIMITIVES['sum'])
+        >>> env.push_frame({'i': 1})
+        >>> env.set_variable_value('x', 3)
+        >>> env.pop_frame()
+        >>> env.lookup_variable('x')
+        3
         """
-        if symbol in self._frames[-1].keys():
-            self._frames[-1][symbol] = val
+        frames, calls = self._frames, self._calls
+        index = len(frames) - 1
+        while index > 0 and symbol not in frames[index] and \
+                calls[index - 1] is None: # A loop frame, which is skipped
+            index -= 1
+        if symbol in frames[index]:
+            frames[index][symbol] = val
+            self._bindings[symbol] = val
         else:
-            self._frames[0][symbol] = val
+            self._globals[symbol] = val
+            if symbol not in self._shadows:
+                self._bindings[symbol] = val
 
     def __str__(self):
         return ';'.join([str(f) for f in self._frames])
@@ -491,69 +866,203 @@ def eval_definition(line, env):
             break
         body.append(line)
     proc = Procedure(procedure_name, len(args), body, False, True, args)
-    #print(procedure_name, args, body)
-    env.procedures[procedure_name] = proc
+    env.define_procedure(procedure_name, proc)
+    logo_compiler.compile_procedure(proc, env)
 
 ###############
 # Interpreter #
 ###############
 
-class LogoError(Exception):
-    """An error raised by the Logo interpreter."""
-
-def error(message):
-    """Raise a Logo error as a Python exception."""
-    raise LogoError(message)
-
 def interpret_line(line, env):
     """Interpret a single line in the read-eval loop."""
-    result = eval_line(Buffer(parse_line(line)), env)
+    env.start_line()
+    if env.engine is not None:
+        result = env.engine.eval_line(parse_line(line), env)
+    else:
+        result = eval_line(Buffer(parse_line(line)), env)
     if result is not None:
-        error('You do not say what to do with {0}.'.format(result))
+        error('You do not say what to do with {0}.'.format(
+            logo_primitives.words_of(result)))
 
 def read_eval_loop(env, get_next_line):
     """Run a read-eval loop for Logo.
 
     get_next_line: a zero-argument fn that returns a line of Logo code (str).
+
+    Errors are printed through env.output, which is flushed after each error
+    and when the loop ends, however it ends.  Queued turtle graphics are drawn
+    before each line is read.
     """
-    while True:
-        try:
-            line = get_next_line()
-            if line.lower() in {'quit', 'exit', 'bye'}:
-                raise EOFError
-            interpret_line(line, env)
-        except (LogoError, SyntaxError) as err:
-            print(err)
-        except (KeyboardInterrupt, EOFError):
-            print('Goodbye!')
-            return
+    output = env.output
+    try:
+        while True:
+            try:
+                logo_primitives.flush_turtle()
+                line = get_next_line()
+                if line.lower() in {'quit', 'exit', 'bye'}:
+                    raise EOFError
+                interpret_line(line, env)
+            except (LogoError, SyntaxError, RecursionError) as err:
+                output.write('{0}\n'.format(err))
+                output.flush()
+            except (KeyboardInterrupt, EOFError):
+                output.write('Goodbye!\n')
+                return
+    finally:
+        logo_primitives.flush_turtle()
+        output.flush()
 
 def strip_comment(line):
     """Return the prefix of line preceding the first semicolon."""
     return line.split(';', 1)[0]
 
-def prompt_for_line(prompt='?'):
-    """Read a line interactively from the user (via standard input)."""
+def prompt_for_line(prompt='?', output=None):
+    """Read a line interactively from the user (via standard input), first
+    flushing output so that everything printed so far appears."""
+    if output is not None:
+        output.flush()
     return strip_comment(input(prompt + ' '))
 
-def generate_lines(src, prompt='?'):
-    """Return a function that returns lines from src, a list of strings."""
+def generate_lines(src, prompt='?', echo=True, output=None):
+    """Return a function that returns lines from src, an iterator over strings
+    such as a file.  Functions that share src share its position.
+
+    echo: whether to print each line after the prompt as it is read.
+
+    output: the Output to which lines are echoed (default: standard output).
+
+    >>> src = iter(['to f', 'end'])
+    >>> get_next_line = generate_lines(src, echo=False)
+    >>> get_continuation_line = generate_lines(src, prompt='>', echo=False)
+    >>> get_next_line(), get_continuation_line()
+    ('to f', 'end')
+    """
+    if output is None:
+        output = Output()
     def pop_line():
-        if not src:
+        line = next(src, None)
+        if line is None:
             raise EOFError
-        line = src.pop(0)
-        print(prompt, line, end='')
+        if echo:
+            output.write(prompt + ' ' + line)
         return strip_comment(line)
     return pop_line
 
-@main
-def run_interpreter(src_file=None):
+# Execution engines, selected with --engine.
+ENGINES = {'tree': None, 'vm': logo_vm, 'closure': logo_closure}
+
+def positive(text):
+    """Convert a command line argument to a positive number."""
+    value = float(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError('must be positive: ' + text)
+    return value
+
+def parse_args(argv):
+    """Parse the command line arguments of the interpreter."""
+    parser = argparse.ArgumentParser(description='A Logo interpreter.')
+    parser.add_argument('src_file', nargs='?', default=None,
+                        help='Logo source file (default: read from a prompt)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='tree',
+                        help='evaluate expression trees, run bytecode, or '
+                             'call compiled Python closures')
+    parser.add_argument('--max-depth', type=int, default=MAX_DEPTH,
+                        help='calls the vm and closure engines can nest '
+                             'before a stack overflow')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not echo the lines of the source file')
+    parser.add_argument('--memoize', action='store_true',
+                        help='cache the outputs of procedures that have no '
+                             'side effects')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time spent in each procedure and line '
+                             'to standard error')
+    parser.add_argument('--profile-sort', choices=logo_profiler.SORT_KEYS,
+                        default='self',
+                        help='the column that sorts the --profile report')
+    parser.add_argument('--sample', metavar='OUT', default=None,
+                        help='sample the procedures being applied and write '
+                             'folded stacks to OUT (SIGUSR1 toggles sampling '
+                             'to OUT, or to logo-PID.folded)')
+    parser.add_argument('--sample-interval', metavar='MS', type=positive,
+                        default=logo_profiler.SAMPLE_INTERVAL * 1000,
+                        help='milliseconds between samples (default: '
+                             '%(default)s)')
+    parser.add_argument('--step-limit', metavar='N', type=int, default=None,
+                        help='stop a line after N procedure calls and loop '
+                             'iterations')
+    parser.add_argument('--time-limit', metavar='SECONDS', type=positive,
+                        default=None, help='stop a line after SECONDS')
+    parser.add_argument('--turtle', choices=logo_primitives.TURTLE_BACKENDS,
+                        default='auto',
+                        help='draw in a Tk window, or record drawings without '
+                             'a display (default: headless when there is no '
+                             'display)')
+    parser.add_argument('--save-drawing', metavar='OUT', default=None,
+                        help='draw headless and write the drawing to OUT '
+                             '(.svg or .png) when the session ends')
+    return parser.parse_args(argv)
+
+def run_session(args, get_next_line, get_continuation_line, output):
+    """Run a read-eval loop in a new environment configured by args, which
+    prints to output."""
+    env = Environment(get_continuation_line, ENGINES[args.engine], output)
+    env.max_depth = args.max_depth
+    env.auto_memoize = args.memoize
+    env.sample_interval = args.sample_interval / 1000
+    env.step_limit, env.time_limit = args.step_limit, args.time_limit
+    if args.save_drawing is not None:
+        logo_primitives.use_turtle('headless')
+    else:
+        logo_primitives.use_turtle(args.turtle)
+    watch_signals(env, args.sample)
+    if args.sample is not None:
+        logo_profiler.start_sampling(env, args.sample)
+    if args.profile:
+        logo_profiler.start(env)
+    try:
+        read_eval_loop(env, get_next_line)
+    finally:
+        if env.sampler is not None:
+            logo_profiler.stop_sampling(env)
+        if args.profile:
+            profiler = logo_profiler.stop(env)
+            sys.stderr.write(profiler.report(args.profile_sort) + '\n')
+        if args.save_drawing is not None:
+            save_drawing(args.save_drawing)
+
+def save_drawing(path):
+    """Write the headless turtle drawing to path, reporting errors to standard
+    error."""
+    try:
+        logo_primitives.save_picture(path)
+    except LogoError as e:
+        sys.stderr.write('{0}\n'.format(e))
+
+def watch_signals(env, path=None):
+    """Toggle sampling of env, to path or to logo-PID.folded, each time the
+    interpreter receives SIGUSR1 (where the platform has it)."""
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+    if path is None:
+        path = 'logo-{0}.folded'.format(os.getpid())
+    def toggle(signum, frame):
+        logo_profiler.toggle_sampling(env, path)
+    signal.signal(signal.SIGUSR1, toggle)
+
+def run_interpreter(*argv):
     """Run a read-eval loop that reads from either a prompt or a file."""
-    get_next_line = prompt_for_line
-    get_continuation_line = lambda: prompt_for_line('>')
-    if src_file != None:
-        src = open(src_file).readlines()
-        get_next_line = generate_lines(src)
-        get_continuation_line = generate_lines(src, prompt='>')
-    env = Environment(get_continuation_line)
-    read_eval_loop(env, get_next_line)
+    args = parse_args(argv)
+    output = Output(limit=OUTPUT_BUFFER) # Flushed at each prompt and error
+    if args.src_file == None:
+        run_session(args, lambda: prompt_for_line('?', output),
+                    lambda: prompt_for_line('>', output), output)
+        return
+    with open(args.src_file) as src: # Lines are read as they are evaluated
+        echo = not args.quiet
+        run_session(args, generate_lines(src, echo=echo, output=output),
+                    generate_lines(src, prompt='>', echo=echo, output=output),
+                    output)
+
+if __name__ == '__main__':
+    run_interpreter(*sys.argv[1:])
@@ -0,0 +1,343 @@
+"""The logo_closure module compiles Logo into nested Python closures.
+
+Each expression tree produced by logo_compiler becomes a Python function of
+the environment, and the body of each user-defined procedure becomes a single
+Python function of its arguments.  Primitive procedures are called directly
+through their Python functions, so evaluation involves no token inspection or
+procedure lookup.
+
+Select this engine with "python3 logo.py --engine=closure FILE".
+
+Calls in tail position return a logo_compiler.PendingCall, which the caller of
+the procedure makes in a loop, as the expression-tree engine does, so
+tail-recursive procedures run in constant Python stack.  Other calls nest
+Python calls, so their depth is limited by Python's recursion limit as well
+as by --max-depth.
+
+Errors raised by primitive functions are converted into LogoErrors when they
+leave a line or procedure, rather than at each primitive call.
+"""
+
+import logo
+import logo_core
+import logo_compiler
+import logo_memo
+import logo_primitives
+from buffer import Buffer
+
+############
+# Compiler #
+############
+
+def compile_expression(expr):
+    """Return a function of an environment that evaluates expr.
+
+    >>> env = logo.Environment()
+    >>> expr = logo_compiler.compile_line(['3', '*', '4'], env)[0]
+    >>> compile_expression(expr)(env)
+    12
+    """
+    kind = type(expr)
+    if kind is logo_compiler.Constant:
+        value = expr.value
+        return lambda env: value
+    elif kind is logo_compiler.Lookup:
+        name = expr.name
+        return lambda env: env.lookup_variable(name)
+    elif kind is logo_compiler.Call:
+        operands = [compile_expression(op) for op in expr.operands]
+        if expr.proc.isprimitive:
+            return compile_primitive_call(expr.proc, operands)
+        return compile_user_call(expr.proc, operands)
+    elif kind is logo_compiler.TailCall:
+        return compile_tail_call(expr)
+    elif kind is logo_compiler.Output:
+        return compile_output(expr)
+    elif kind is logo_compiler.Infix:
+        return compile_infix(expr.proc, compile_expression(expr.left),
+                             compile_expression(expr.right))
+    elif kind is logo_compiler.If:
+        return compile_if(expr)
+    elif kind is logo_compiler.IfElse:
+        return compile_ifelse(expr)
+    elif kind is logo_compiler.Repeat:
+        return compile_repeat(expr)
+    elif kind is logo_compiler.For:
+        return compile_for(expr)
+    elif kind is logo_compiler.While:
+        return compile_while(expr)
+    elif kind in (logo_compiler.Run, logo_compiler.Condition):
+        return compile_block(expr.block)
+    elif kind is logo_compiler.Profiled:
+        return compile_profiled(expr)
+    elif kind is logo_compiler.Definition:
+        tokens = expr.tokens
+        return lambda env: logo.eval_definition(Buffer(tokens), env)
+    elif kind is logo_compiler.Fail:
+        before = [compile_expression(e) for e in expr.before]
+        message = expr.message
+        def fail(env):
+            for fn in before:
+                fn(env)
+            logo_core.error(message)
+        return fail
+    raise TypeError('Cannot compile {0}'.format(expr))
+
+def compile_primitive_call(proc, operands):
+    """Compile a call that applies the Python function of a primitive."""
+    fn, needs_env = proc.body, proc.needs_env
+    if len(operands) == 0:
+        if needs_env:
+            return lambda env: fn(env)
+        return lambda env: fn()
+    elif len(operands) == 1:
+        a, = operands
+        if needs_env:
+            return lambda env: fn(a(env), env)
+        return lambda env: fn(a(env))
+    elif len(operands) == 2:
+        a, b = operands
+        if needs_env:
+            return lambda env: fn(a(env), b(env), env)
+        return lambda env: fn(a(env), b(env))
+    if needs_env:
+        return lambda env: fn(*[op(env) for op in operands] + [env])
+    return lambda env: fn(*[op(env) for op in operands])
+
+def compile_user_call(proc, operands):
+    """Compile a call to a user-defined procedure."""
+    def call(env):
+        args = [op(env) for op in operands]
+        if proc.memo is not None:
+            return logo_memo.call(call_procedure, proc, args, env)
+        return call_procedure(proc, args, env)
+    return call
+
+def compile_tail_call(expr):
+    """Compile a call in tail position, which returns a PendingCall."""
+    operands = [compile_expression(op) for op in expr.call.operands]
+    proc, output, replace_frame = expr.call.proc, expr.output, \
+        expr.replace_frame
+    PendingCall = logo_compiler.PendingCall
+    def tail_call(env):
+        args = [op(env) for op in operands]
+        return PendingCall(proc, args, output, replace_frame)
+    return tail_call
+
+def compile_output(expr):
+    """Compile an "output" whose input may be a call in tail position."""
+    operand = compile_expression(expr.operand)
+    fn, PendingCall = expr.call.proc.body, logo_compiler.PendingCall
+    def output(env):
+        val = operand(env)
+        if type(val) is PendingCall:
+            return val
+        return fn(val)
+    return output
+
+def call_procedure(proc, args, env):
+    """Call a user-defined procedure, making the calls in tail position that
+    its body returns in a loop, so that they do not nest Python calls.
+
+    >>> env = logo.Environment(engine=logo.ENGINES['closure'])
+    >>> body = iter(['if :n = 0 [output "done]', 'output count :n - 1', 'end'])
+    >>> env.get_continuation_line = lambda: next(body)
+    >>> eval_line(['to', 'count', ':n'], env)
+    >>> eval_line(['print', 'count', '100000'], env)
+    done
+    """
+    frames, must_not_output, stores = 0, False, []
+    PendingCall = logo_compiler.PendingCall
+    try:
+        while True:
+            if env.depth() >= env.max_depth:
+                logo_core.error('Stack overflow')
+            env.push_frame(dict(zip(proc.formal_params, args)), proc)
+            frames += 1
+            result = (proc.closure or compile_procedure(proc, env))(env)
+            if type(result) is not PendingCall:
+                break
+            must_not_output = must_not_output or not result.output
+            if result.proc.memo is not None: # Its output may be cached
+                value, store = logo_memo.lookup(result.proc, result.args)
+                if value is not logo_memo.MISSING:
+                    result = value
+                    break
+                if store is not None: # Cached once the loop ends
+                    stores.append(store)
+            if result.replace_frame:
+                env.pop_frame()
+                frames -= 1
+            proc, args = result.proc, result.args
+    finally:
+        for _ in range(frames):
+            env.pop_frame()
+    if must_not_output and result is not None:
+        logo_core.error("You do not say what to do with {0}".format(
+            logo_primitives.words_of(result)))
+    for memo, key, generation in stores:
+        memo.put(key, result, generation)
+    return result
+
+def compile_infix(proc, left, right):
+    """Compile an infix operator, which passes no environment."""
+    if proc.isprimitive:
+        fn = proc.body
+        return lambda env: fn(left(env), right(env))
+    return lambda env: logo.logo_apply(proc, [left(env), right(env)])
+
+def compile_if(expr):
+    condition = compile_expression(expr.condition)
+    block = compile_block(expr.block)
+    def logo_if(env):
+        val = condition(env)
+        if val is True or val == 'True':
+            return block(env)
+        elif val is False or val == 'False':
+            return None
+        logo_compiler.check_condition(expr.condition, 'if', val)
+        return logo.logo_apply(expr.proc, [val, expr.exp, env])
+    return logo_if
+
+def compile_ifelse(expr):
+    condition = compile_expression(expr.condition)
+    true_block = compile_block(expr.true_block)
+    false_block = compile_block(expr.false_block)
+    def logo_ifelse(env):
+        val = condition(env)
+        if val is True or val == 'True':
+            return true_block(env)
+        elif val is False or val == 'False':
+            return false_block(env)
+        logo_compiler.check_condition(expr.condition, 'ifelse', val)
+        args = [val, expr.true_exp, expr.false_exp, env]
+        return logo.logo_apply(expr.proc, args)
+    return logo_ifelse
+
+def compile_repeat(expr):
+    count = compile_expression(expr.count)
+    block = compile_block(expr.block)
+    def repeat(env):
+        n = logo_primitives.to_int(count(env))
+        outer = env.repcount
+        try:
+            for i in range(1, n + 1):
+                env.step()
+                env.repcount = i
+                block(env)
+        finally:
+            env.repcount = outer
+        return None
+    return repeat
+
+def compile_for(expr):
+    limits = [compile_expression(limit) for limit in expr.limits]
+    block = compile_block(expr.block)
+    name = expr.name
+    def logo_for(env):
+        values = logo_primitives.for_values(*[limit(env) for limit in limits])
+        env.push_frame({name: None})
+        try:
+            for value in values:
+                env.step()
+                env.set_variable_value(name, value)
+                block(env)
+        finally:
+            env.pop_frame()
+        return None
+    return logo_for
+
+def compile_while(expr):
+    condition = compile_expression(expr.condition)
+    block = compile_block(expr.block)
+    name, stop = expr.name, expr.name == 'until'
+    test = logo_primitives.loop_condition
+    def logo_while(env):
+        while test(name, condition(env)) != stop:
+            env.step()
+            block(env)
+        return None
+    return logo_while
+
+def compile_profiled(expr):
+    block = compile_block(expr.block)
+    profiler, name, index = expr.profiler, expr.name, expr.index
+    def profiled(env):
+        profiler.enter(name, index)
+        try:
+            return block(env)
+        finally:
+            profiler.exit()
+    return profiled
+
+def compile_block(block):
+    """Return a function that evaluates a compiled line, stopping at the first
+    expression with a value."""
+    fns = [compile_expression(expr) for expr in block]
+    if not fns:
+        return lambda env: None
+    elif len(fns) == 1:
+        return fns[0]
+    def run_block(env):
+        for fn in fns:
+            result = fn(env)
+            if result is not None:
+                return result
+        return None
+    return run_block
+
+def compile_procedure(proc, env):
+    """Compile the body of a user-defined procedure into a function of an
+    environment in which its arguments are bound, which returns its output,
+    None, or a call in tail position as a PendingCall."""
+    code = proc.code
+    if code is None:
+        code = logo_compiler.compile_procedure(proc, env)
+    lines = [compile_block(block) for block in code]
+    PendingCall = logo_compiler.PendingCall
+
+    def procedure(env):
+        current = procedure
+        for index in range(len(lines)):
+            if proc.closure is not current: # Redefinitions invalidated it
+                current = proc.closure or compile_procedure(proc, env)
+            result = current.lines[index](env)
+            if result is not None:
+                if logo_core.isoutput(result):
+                    return result[1]
+                elif type(result) is PendingCall:
+                    return result
+                logo_core.error("You do not say what to do with {0}".format(
+                    logo_primitives.words_of(result)))
+        return None
+    procedure.lines = lines
+    proc.closure = procedure
+    return procedure
+
+##########
+# Engine #
+##########
+
+def apply_procedure(proc, args, env):
+    """Apply a user-defined procedure to a list of argument values."""
+    try:
+        return call_procedure(proc, args, env)
+    except logo_core.LogoError:
+        raise
+    except Exception as e:
+        logo_core.error(e) # Convert any error into a LogoError
+
+def eval_line(tokens, env):
+    """Evaluate a top-level line (list of tokens) and return its value.
+
+    >>> eval_line(['print', 'sum', '1', '2', '3'], logo.Environment())
+    3
+    3
+    """
+    fn = compile_block(logo_compiler.compile_line(tokens, env))
+    try:
+        return fn(env)
+    except logo_core.LogoError:
+        raise
+    except Exception as e:
+        logo_core.error(e)
@@ -0,0 +1,567 @@
+"""The logo_compiler module compiles lines of Logo into expression trees.
+
+A line is compiled by the same rules that logo.logo_eval uses to evaluate it:
+the arity of each procedure is looked up as its name is reached, and infix
+operators are grouped by precedence.  The result is a list of expressions, one
+per top-level expression in the line, that can be evaluated repeatedly without
+parsing the line again.
+
+Compilation depends on the procedures that were defined when it happened.  The
+names looked up are recorded so that compiled code can be discarded when any of
+them is redefined (see Environment.define_procedure).
+
+Arithmetic, comparisons, and logic on constants are computed while compiling,
+as long as the primitives that compute them have not been redefined, and an
+"if" or "ifelse" with a constant condition is compiled as the branch it takes.
+"""
+
+import logo
+import logo_core
+import logo_memo
+import logo_primitives
+from buffer import Buffer
+from logo_lists import islist
+
+###############
+# Expressions #
+###############
+
+class Expression(object):
+    """A compiled Logo expression."""
+    def eval(self, env):
+        """Evaluate this expression in env and return its value."""
+        raise NotImplementedError
+
+class Constant(Expression):
+    """A self-evaluating token, a quoted word, or a list."""
+    def __init__(self, value):
+        self.value = value
+
+    def eval(self, env):
+        return self.value
+
+class Lookup(Expression):
+    """A variable reference."""
+    def __init__(self, name):
+        self.name = name
+
+    def eval(self, env):
+        return env.lookup_variable(self.name)
+
+class Call(Expression):
+    """A procedure applied to operand expressions."""
+    def __init__(self, proc, operands):
+        self.proc = proc
+        self.operands = operands
+
+    def eval(self, env):
+        args = [operand.eval(env) for operand in self.operands]
+        if self.proc.needs_env:
+            args.append(env)
+        return logo.logo_apply(self.proc, args)
+
+class Infix(Expression):
+    """An infix operator applied to its left and right operands."""
+    def __init__(self, proc, left, right):
+        self.proc = proc
+        self.left = left
+        self.right = right
+
+    def eval(self, env):
+        left = self.left.eval(env)
+        return logo.logo_apply(self.proc, [left, self.right.eval(env)])
+
+class If(Expression):
+    """An "if" whose body is a literal list, compiled as a block."""
+    def __init__(self, proc, condition, exp, block):
+        self.proc = proc
+        self.condition = condition
+        self.exp = exp
+        self.block = block
+
+    def eval(self, env):
+        val = self.condition.eval(env)
+        if val is True or val == 'True':
+            return run_block(self.block, env)
+        elif val is False or val == 'False':
+            return None
+        check_condition(self.condition, 'if', val)
+        return logo.logo_apply(self.proc, [val, self.exp, env])
+
+class IfElse(Expression):
+    """An "ifelse" whose branches are literal lists, compiled as blocks."""
+    def __init__(self, proc, condition, true_exp, false_exp, true_block,
+                 false_block):
+        self.proc = proc
+        self.condition = condition
+        self.true_exp = true_exp
+        self.false_exp = false_exp
+        self.true_block = true_block
+        self.false_block = false_block
+
+    def eval(self, env):
+        val = self.condition.eval(env)
+        if val is True or val == 'True':
+            return run_block(self.true_block, env)
+        elif val is False or val == 'False':
+            return run_block(self.false_block, env)
+        check_condition(self.condition, 'ifelse', val)
+        args = [val, self.true_exp, self.false_exp, env]
+        return logo.logo_apply(self.proc, args)
+
+def check_condition(condition, name, val):
+    """Raise the error for a condition that is not True or False, unless the
+    condition is a value that the primitive would evaluate again as a line."""
+    if type(condition) is Condition:
+        message = 'First argument to "{0}" is not True or False: {1}'
+        logo_core.error(message.format(name, val))
+
+class Repeat(Expression):
+    """A "repeat" whose body is a literal list, compiled as a block."""
+    def __init__(self, count, block):
+        self.count = count
+        self.block = block
+
+    def eval(self, env):
+        n = self.count.eval(env)
+        try:
+            n = logo_primitives.to_int(n)
+        except Exception as e:
+            logo_core.error(e)
+        outer = env.repcount
+        try:
+            for count in range(1, n + 1):
+                env.step()
+                env.repcount = count
+                run_block(self.block, env)
+        finally:
+            env.repcount = outer
+        return None
+
+class For(Expression):
+    """A "for" whose control list and body are literal lists.  The variable
+    called name is bound in one frame for the whole loop."""
+    def __init__(self, name, limits, block):
+        self.name = name
+        self.limits = limits
+        self.block = block
+
+    def eval(self, env):
+        limits = [expr.eval(env) for expr in self.limits]
+        values = logo_primitives.for_values(*limits)
+        name = self.name
+        env.push_frame({name: None})
+        try:
+            for value in values:
+                env.step()
+                env.set_variable_value(name, value)
+                run_block(self.block, env)
+        finally:
+            env.pop_frame()
+        return None
+
+class While(Expression):
+    """A "while" or "until" (the name) whose condition and body are literal
+    lists, compiled as blocks."""
+    def __init__(self, name, condition, block):
+        self.name = name
+        self.condition = condition
+        self.block = block
+
+    def eval(self, env):
+        name, stop = self.name, self.name == 'until'
+        test = logo_primitives.loop_condition
+        while test(name, self.condition.eval(env)) != stop:
+            env.step()
+            run_block(self.block, env)
+        return None
+
+class Run(Expression):
+    """A "run" of a literal list, compiled as a block."""
+    def __init__(self, block):
+        self.block = block
+
+    def eval(self, env):
+        return run_block(self.block, env)
+
+class Condition(Run):
+    """A literal list condition of an "if" or "ifelse", compiled as a block."""
+
+class Profiled(Expression):
+    """A line of the body of a procedure called name, whose evaluation is timed
+    by a profiler (see logo_profiler)."""
+    def __init__(self, profiler, name, index, block):
+        self.profiler = profiler
+        self.name = name
+        self.index = index
+        self.block = block
+
+    def eval(self, env):
+        profiler = self.profiler
+        profiler.enter(self.name, self.index)
+        try:
+            return run_block(self.block, env)
+        finally:
+            profiler.exit()
+
+class Definition(Expression):
+    """A "to" definition, which reads its body when evaluated."""
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def eval(self, env):
+        return logo.eval_definition(Buffer(self.tokens), env)
+
+class Fail(Expression):
+    """An expression that could not be compiled.
+
+    Evaluating it evaluates the expressions that logo_eval would have evaluated
+    before finding the problem, then raises the error that logo_eval raises.
+    """
+    def __init__(self, before, message):
+        self.before = before
+        self.message = message
+
+    def eval(self, env):
+        for expr in self.before:
+            expr.eval(env)
+        logo_core.error(self.message)
+
+class Output(Expression):
+    """An "output" whose input may be a call in tail position."""
+    def __init__(self, call, operand):
+        self.call = call
+        self.operand = operand
+
+    def eval(self, env):
+        val = self.operand.eval(env)
+        if type(val) is PendingCall:
+            return val
+        return logo.logo_apply(self.call.proc, [val])
+
+class TailCall(Expression):
+    """A call to a user-defined procedure in tail position.  Evaluating it
+    evaluates the operands and returns a PendingCall for logo_apply to make.
+
+    output: whether the caller outputs the value of the call.  Otherwise the
+            call is the last statement of the caller, and must not output.
+    """
+    def __init__(self, call, caller, output):
+        self.call = call
+        self.output = output
+        # The caller's frame can be discarded when the callee's frame shadows
+        # every name that it binds.
+        self.replace_frame = set(caller.formal_params) <= \
+            set(call.proc.formal_params)
+
+    def eval(self, env):
+        args = [operand.eval(env) for operand in self.call.operands]
+        return PendingCall(self.call.proc, args, self.output,
+                           self.replace_frame)
+
+class PendingCall(object):
+    """A call to a user-defined procedure that its caller returns."""
+    __slots__ = ('proc', 'args', 'output', 'replace_frame')
+
+    def __init__(self, proc, args, output, replace_frame):
+        self.proc = proc
+        self.args = args
+        self.output = output
+        self.replace_frame = replace_frame
+
+def run_block(block, env):
+    """Evaluate a compiled line, stopping at the first expression with a value.
+
+    >>> env = logo.Environment()
+    >>> run_block(compile_line(['print', '1', '2', 'print', '3'], env), env)
+    1
+    2
+    """
+    for expr in block:
+        result = expr.eval(env)
+        if result is not None:
+            return result
+    return None
+
+############
+# Compiler #
+############
+
+class CompileError(Exception):
+    """Raised to abandon a line that logo_eval could not evaluate."""
+    def __init__(self, message, before=()):
+        Exception.__init__(self, message)
+        self.message = message
+        self.before = list(before)
+
+def compile_line(tokens, env, names=None):
+    """Compile a line (list of tokens) into a list of expressions.
+
+    names: a set to which the names of the procedures looked up are added.
+
+    >>> env = logo.Environment()
+    >>> block = compile_line(['print', 'sum', '1', '2', '+', '3'], env)
+    >>> run_block(block, env)
+    6
+    >>> run_block(compile_line(['print', 'garply'], env), env)
+    Traceback (most recent call last):
+        ...
+    logo_core.LogoError: I do not know how to garply.
+    """
+    if names is None:
+        names = set()
+    line = Buffer(tokens)
+    block = []
+    while line.current is not None:
+        try:
+            block.append(compile_expression(line, env, names))
+        except CompileError as e:
+            block.append(Fail(e.before, e.message))
+            break
+    return block
+
+def compile_expression(line, env, names, pre_operator=False):
+    """Compile the first expression in a line, as logo.logo_eval evaluates it."""
+    if line.current == None:
+        raise CompileError('Ran out of input at {0}'.format(line))
+    elif line.current == ')':
+        raise CompileError('Unexpected ")" at {0}'.format(line))
+
+    result = compile_noninfix(line, env, names)
+    while not islist(line.current) and line.current in logo.INFIX_SYMBOLS:
+        operator = line.current
+        proc = lookup_procedure(logo.INFIX_SYMBOLS[operator], env, names)
+        if operator in logo.INFIX_GROUPS[2]:
+            line.pop()
+            right = compile_operand(line, env, names, [result],
+                                    compile_noninfix)
+        else:
+            if pre_operator:
+                return result
+            line.pop()
+            right = compile_operand(line, env, names, [result],
+                                    compile_expression,
+                                    operator not in logo.INFIX_GROUPS[0])
+        result = fold(proc, [result, right]) or Infix(proc, result, right)
+    return result
+
+def compile_noninfix(line, env, names):
+    """Compile the next expression in a line, ignoring infix operators."""
+    if line.current is None:
+        raise CompileError('Ran out of input at {0}'.format(line))
+    token = line.pop()
+    if logo.isprimitive(token):
+        return Constant(logo.primitive_value(token))
+    elif logo.isvariable(token):
+        try:
+            return Lookup(logo.variable_name(token))
+        except ValueError as e:
+            raise CompileError(str(e))
+    elif logo.isdefinition(token):
+        tokens = line.contents[line.index:]
+        line.index = len(line.contents)
+        return Definition(tokens)
+    elif logo.isquoted(token):
+        return Constant(logo.text_of_quotation(token))
+    elif token == '(':
+        result = compile_expression(line, env, names)
+        if line.current != ')':
+            raise CompileError('Expected ")" at {0}'.format(line), [result])
+        line.pop()
+        return result
+    else:
+        proc = lookup_procedure(token, env, names)
+        if not proc:
+            raise CompileError('I do not know how to {0}.'.format(token))
+        return compile_call(proc, line, env, names)
+
+def compile_operand(line, env, names, before, compile_fn, *args):
+    """Compile an operand, adding the already compiled expressions in before to
+    any error raised."""
+    try:
+        return compile_fn(line, env, names, *args)
+    except CompileError as e:
+        e.before[:0] = before
+        raise
+
+def compile_call(proc, line, env, names):
+    """Compile a call to proc, collecting its operands from line."""
+    operands = []
+    while line.current is not None and len(operands) < proc.arg_count:
+        operands.append(compile_operand(line, env, names, operands,
+                                        compile_expression))
+    if len(operands) < proc.arg_count:
+        message = 'Found only {0} of {1} args at {2}'
+        raise CompileError(message.format(len(operands), proc.arg_count, line),
+                           operands)
+    return compile_special_form(proc, operands, env, names) or \
+        fold(proc, operands) or Call(proc, operands)
+
+def compile_special_form(proc, operands, env, names):
+    """Compile a control primitive with literal list operands into an
+    expression that evaluates its compiled lists, or return None."""
+    if not proc.isprimitive:
+        return None
+    exps = [op.value if type(op) is Constant else None for op in operands]
+    lists = [islist(exp) for exp in exps]
+    compile_list = lambda exp: compile_line(exp, env, names)
+    if logo_core.isprimitive_named(proc, 'if') and lists[1]:
+        branch = constant_condition(operands[0])
+        if branch is not None:
+            return Run(compile_list(exps[1]) if branch else [])
+        return If(proc, compile_condition(operands[0], env, names), exps[1],
+                  compile_list(exps[1]))
+    elif logo_core.isprimitive_named(proc, 'ifelse') and lists[1] and lists[2]:
+        branch = constant_condition(operands[0])
+        if branch is not None:
+            return Run(compile_list(exps[1] if branch else exps[2]))
+        return IfElse(proc, compile_condition(operands[0], env, names),
+                      exps[1], exps[2], compile_list(exps[1]),
+                      compile_list(exps[2]))
+    elif proc.body is logo_primitives.repeat and lists[1]:
+        return Repeat(operands[0], compile_list(exps[1]))
+    elif proc.body is logo_primitives.logo_for and lists[0] and lists[1]:
+        return compile_for(exps[0], compile_list(exps[1]), env, names)
+    elif proc.body in (logo_primitives.logo_while,
+                       logo_primitives.logo_until) and lists[0] and lists[1]:
+        return While(proc.name, Condition(compile_list(exps[0])),
+                     compile_list(exps[1]))
+    elif logo_core.isprimitive_named(proc, 'run') and lists[0]:
+        return Run(compile_list(exps[0]))
+    return None
+
+def compile_condition(operand, env, names):
+    """Compile the condition of an "if" or "ifelse".  A literal list condition
+    is evaluated as a line."""
+    if type(operand) is Constant and islist(operand.value):
+        return Condition(compile_line(operand.value, env, names))
+    return operand
+
+def compile_for(control, block, env, names):
+    """Compile a "for" with a literal control list, or return None if the
+    control list is malformed, so that the primitive reports the error."""
+    try:
+        name, tokens = logo_primitives.for_control(control)
+    except logo_core.LogoError:
+        return None
+    limits = compile_line(tokens, env, names)
+    if len(limits) not in (2, 3) or any(type(e) is Fail for e in limits):
+        return None
+    return For(name, limits, block)
+
+def constant_condition(operand):
+    """Return True or False if operand is a constant condition, or None."""
+    if type(operand) is Constant:
+        val = operand.value
+        if val is True or val == 'True':
+            return True
+        elif val is False or val == 'False':
+            return False
+    return None
+
+def lookup_procedure(name, env, names):
+    """Look up the procedure called name, recording that it was looked up."""
+    names.add(name)
+    return env.procedures.get(name, None)
+
+def compile_procedure(proc, env):
+    """Compile the body of a user-defined procedure, one block per line.
+
+    The procedure is registered with env so that its compiled body is discarded
+    when a procedure that it looked up is redefined, and is memoized if env
+    memoizes pure procedures automatically.  While env is being profiled, each
+    line is timed.
+    """
+    names = set()
+    proc.code = [compile_line(line, env, names) for line in proc.body]
+    for index, block in enumerate(proc.code):
+        mark_statements(block, proc, index == len(proc.code) - 1)
+    if env.profiler is not None:
+        proc.code = [profile_line(proc, index, block, env.profiler)
+                     for index, block in enumerate(proc.code)]
+    for name in names:
+        env.dependents.setdefault(name, set()).add(proc)
+    logo_memo.detect(proc, env)
+    return proc.code
+
+####################
+# Constant folding #
+####################
+
+# The primitives applied while compiling when all of their operands are
+# constants.  They compute numbers and booleans from their inputs alone.
+FOLDED = {'sum', 'difference', 'product', 'div', 'equalp', 'lessp',
+          'greaterp', 'or', 'and', 'not'}
+
+def fold(proc, operands):
+    """Return a Constant for the value of proc applied to constant operands if
+    proc is one of the FOLDED primitives, or None.  A call that raises an
+    error is not folded, so that the error is raised when it is evaluated.
+
+    >>> env = logo.Environment()
+    >>> [expr.value for expr in compile_line(['3', '*', '100', '+', '2'], env)]
+    [302]
+    >>> block = compile_line(['ifelse', '2', '=', '3', ['1'], ['2']], env)
+    >>> type(block[0]).__name__, run_block(block, env)
+    ('Run', 2)
+    >>> type(compile_line(['sum', '1', '"a'], env)[0]).__name__
+    'Call'
+    """
+    if proc.name not in FOLDED or \
+            not logo_core.isprimitive_named(proc, proc.name):
+        return None # Not a folded primitive, or redefined by the user
+    if not all(type(operand) is Constant for operand in operands):
+        return None
+    try:
+        body = logo_core.untimed(proc).body
+        return Constant(body(*[operand.value for operand in operands]))
+    except Exception:
+        return None
+
+def profile_line(proc, index, block, profiler):
+    """Return a block that evaluates line index of the body of proc, timed by
+    profiler."""
+    profiler.sources[(proc.name, index)] = logo.render(proc.body[index])
+    return [Profiled(profiler, proc.name, index, block)]
+
+##############
+# Tail calls #
+##############
+
+def mark_statements(block, caller, last):
+    """Mark the tail calls in a block whose value is the value of a line of the
+    body of caller.
+
+    last: whether the block ends the body, so its last statement is a tail call.
+    """
+    for index, expr in enumerate(block):
+        block[index] = mark_statement(expr, caller,
+                                      last and index == len(block) - 1)
+
+def mark_statement(expr, caller, last):
+    kind = type(expr)
+    if kind is Call and logo_core.isprimitive_named(expr.proc, 'output'):
+        return Output(expr, mark_value(expr.operands[0], caller))
+    elif kind in (If, IfElse, Run):
+        for block in blocks_of(expr):
+            mark_statements(block, caller, last)
+    elif kind is Call and last and not expr.proc.isprimitive:
+        return TailCall(expr, caller, False)
+    return expr
+
+def mark_value(expr, caller):
+    """Mark the tail calls in an expression whose value caller outputs."""
+    kind = type(expr)
+    if kind is Call and not expr.proc.isprimitive:
+        return TailCall(expr, caller, True)
+    elif kind in (If, IfElse, Run):
+        for block in blocks_of(expr):
+            if block:
+                block[-1] = mark_value(block[-1], caller)
+    return expr
+
+def blocks_of(expr):
+    """Return the blocks that may provide the value of expr."""
+    if type(expr) is IfElse:
+        return [expr.true_block, expr.false_block]
+    return [expr.block]
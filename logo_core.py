@@ -0,0 +1,97 @@
+"""The logo_core module defines the pieces of the interpreter that the logo
+module and the engines that it imports (logo_compiler, logo_vm, logo_closure)
+all use: procedures, the table of primitive procedures, Logo errors, and the
+outputs of procedure bodies.
+
+When logo.py runs as a script, it is the __main__ module, and the engines
+import it again as logo.  Whatever must be the same object in both, such as
+the primitive procedures that the compilers recognize, is kept here.
+"""
+
+class Procedure(object):
+    """A Logo procedure, either primitive or user-defined.
+
+    name: The name of the procedure.  For primitive procedures with multiple
+          names, only one is stored here.
+
+    arg_count: Number of arguments required by the procedure.
+
+    body: A Logo procedure body is either:
+            a Python function, if isprimitive == True
+            a list of lines,   if isprimitive == False
+
+    isprimitive: whether the procedure is primitive.
+
+    needs_env: whether the environment should be passed as an add'l parameter.
+
+    pure: whether a primitive procedure has no side effects (see logo_memo).
+
+    formal_params: list of formal parameter names (user-defined procedures).
+
+    code: the compiled body of a user-defined procedure, one list of
+          expressions per line, or None if it must be compiled before use.
+
+    bytecode: the body compiled for the bytecode engine (see logo_vm), or None.
+
+    closure: the body compiled into a Python function (see logo_closure), or
+             None.
+
+    memo: the cached outputs of a memoized procedure (see logo_memo), or None.
+
+    original: the primitive that a timed copy of a primitive calls (see
+              logo_profiler), or None.
+    """
+    def __init__(self, name, arg_count, body, isprimitive=False,
+                 needs_env=False, formal_params=None, pure=False):
+        self.name = name
+        self.arg_count = arg_count
+        self.body = body
+        self.isprimitive = isprimitive
+        self.needs_env = needs_env
+        self.pure = pure
+        if not formal_params:
+            formal_params = [str(i) for i in range(arg_count)]
+        self.formal_params = formal_params
+        self.code = None
+        self.bytecode = None
+        self.closure = None
+        self.memo = None
+        self.original = None
+
+    def invalidate(self):
+        """Discard the compiled body, which will be compiled again when used."""
+        self.code = None
+        self.bytecode = None
+        self.closure = None
+
+    def __str__(self):
+        params = ' '.join([':'+p for p in self.formal_params])
+        return 'to {0} {1}'.format(self.name, params)
+
+# The primitive procedures, shared by every environment until it defines a
+# procedure of its own.  Primitive Procedure objects are never modified.  The
+# table is filled by logo.primitives when the first Environment is created.
+PRIMITIVES = dict()
+
+def untimed(proc):
+    """Return the primitive that proc times, if it is a timed copy made by a
+    profiler, or else proc itself."""
+    return proc.original or proc
+
+def isprimitive_named(proc, *names):
+    """Return whether proc is the primitive procedure called one of names, or a
+    timed copy of it, rather than a procedure that replaced it."""
+    proc = untimed(proc)
+    return any(PRIMITIVES.get(name) is proc for name in names)
+
+def isoutput(result):
+    """Return whether result is a two-element tuple starting with 'OUTPUT'."""
+    length_two = type(result) == tuple and len(result) == 2
+    return length_two and result[0] == 'OUTPUT'
+
+class LogoError(Exception):
+    """An error raised by the Logo interpreter."""
+
+def error(message):
+    """Raise a Logo error as a Python exception."""
+    raise LogoError(message)
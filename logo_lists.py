@@ -0,0 +1,104 @@
+"""The logo_lists module implements Logo lists that share their elements.
+
+Lists read from Logo source are Python lists.  The list primitives that take
+lists apart or extend them (butfirst, butlast, and fput) return a LogoList,
+which shares its elements with the list it was made from instead of copying
+them, so walking down a list or building one up takes constant time per step.
+Both kinds of list are Logo lists; islist recognizes either.
+"""
+
+import itertools
+
+class LogoList(object):
+    """An immutable Logo list that shares its elements with other lists.
+
+    The elements are stored in reverse order in an array that may be shared by
+    many lists, each of which views a slice array[start:end] of it.  Removing
+    the first or last element narrows the slice.  Adding a first element
+    appends to the array if no other list has appended there already, and
+    copies the slice otherwise.
+
+    >>> a = LogoList(['1', '2', '3'])
+    >>> b = a[1:]
+    >>> c = b.fput('4')
+    >>> a, b, c, c[:-1]
+    (['1', '2', '3'], ['2', '3'], ['4', '2', '3'], ['4', '2'])
+    >>> b.fput('5'), c == ['4', '2', '3'], c[0], c[-1]
+    (['5', '2', '3'], True, '4', '3')
+    """
+    __slots__ = ('_items', '_start', '_end')
+
+    def __init__(self, elements=()):
+        self._items = list(elements)
+        self._items.reverse()
+        self._start, self._end = 0, len(self._items)
+
+    @classmethod
+    def _view(cls, items, start, end):
+        """Return a list of the elements of the reversed array items[start:end],
+        without copying them."""
+        view = object.__new__(cls)
+        view._items, view._start, view._end = items, start, end
+        return view
+
+    def fput(self, item):
+        """Return a list with item followed by the elements of this list."""
+        items, start, end = self._items, self._start, self._end
+        if end != len(items):
+            items = items[start:end]
+            start, end = 0, end - start
+        items.append(item)
+        return LogoList._view(items, start, end + 1)
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, index):
+        n = self._end - self._start
+        if type(index) is slice:
+            start, stop, step = index.indices(n)
+            if step != 1:
+                return LogoList(list(self)[index])
+            stop = max(start, stop)
+            return LogoList._view(self._items, self._end - stop,
+                                  self._end - start)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('list index out of range')
+        return self._items[self._end - 1 - index]
+
+    def __iter__(self):
+        items = self._items
+        return (items[i] for i in range(self._end - 1, self._start - 1, -1))
+
+    def __eq__(self, other):
+        if not islist(other):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            x == y for x, y in zip(self, other))
+
+    __hash__ = None # Lists are not hashable, as Python lists are not
+
+    def __add__(self, other):
+        if not islist(other):
+            return NotImplemented
+        return LogoList(itertools.chain(self, other))
+
+    def __radd__(self, other):
+        if not islist(other):
+            return NotImplemented
+        return LogoList(itertools.chain(other, self))
+
+    def __repr__(self):
+        return repr(list(self))
+
+def islist(x):
+    """Return whether x is a Logo list: a Python list or a LogoList."""
+    return isinstance(x, (list, LogoList))
+
+def shared(x):
+    """Return a list x as a LogoList, so that its parts can share elements."""
+    if type(x) is list:
+        return LogoList(x)
+    return x
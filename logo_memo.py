@@ -0,0 +1,197 @@
+"""The logo_memo module caches the outputs of user-defined procedures.
+
+A procedure is memoized by the "memoize" primitive, or automatically when the
+interpreter is run with --memoize and the procedure is pure.  A pure procedure
+has no side effects and depends on nothing but its arguments: it refers to no
+variables other than its formal parameters, and calls only pure primitives and
+pure procedures.  Control primitives are pure when their lists are literal.
+
+The outputs of a memoized procedure are kept in a Memo, keyed on the values of
+its arguments.  Calls with a list argument are not cached.  When a procedure is
+redefined, the outputs of every procedure that might call it are discarded.
+"""
+
+from collections import OrderedDict
+
+import logo
+import logo_compiler
+
+# The default number of outputs that a memoized procedure keeps.
+MEMO_SIZE = 10000
+
+# The value of Memo.get for arguments that have no cached output.
+MISSING = object()
+
+class Memo(object):
+    """The cached outputs of a procedure, evicting the least recently used.
+
+    automatic: whether the procedure was found to be pure, rather than
+               memoized by the "memoize" primitive.
+
+    generation: the number of times that the outputs were discarded.  An output
+                computed across a discard is not stored.
+
+    >>> memo = Memo(size=2)
+    >>> for n in ['1', '2', '1', '3']:
+    ...     if memo.get((n,)) is MISSING:
+    ...         memo.put((n,), n + n, memo.generation)
+    >>> list(memo.outputs.values())
+    ['11', '33']
+    >>> print(memo)
+    1 hits, 3 misses, 2 outputs
+    """
+    def __init__(self, size=MEMO_SIZE, automatic=False):
+        self.outputs = OrderedDict()
+        self.size = size
+        self.automatic = automatic
+        self.hits = self.misses = 0
+        self.generation = 0
+
+    def key(self, args):
+        """Return the key for a list of argument values, or None if it has no
+        key because an argument is a list.  Keys include the types of the
+        values, since 1, 1.0, and True are equal but print differently."""
+        key = tuple(args) + tuple(map(type, args))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        """Return the output cached for key, or MISSING."""
+        value = self.outputs.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.outputs.move_to_end(key)
+        return value
+
+    def put(self, key, value, generation):
+        """Cache value for key if it was computed in the current generation."""
+        if generation != self.generation:
+            return
+        self.outputs[key] = value
+        if len(self.outputs) > self.size:
+            self.outputs.popitem(last=False)
+
+    def clear(self):
+        """Discard all cached outputs."""
+        self.outputs.clear()
+        self.generation += 1
+
+    def __str__(self):
+        return '{0} hits, {1} misses, {2} outputs'.format(
+            self.hits, self.misses, len(self.outputs))
+
+def call(apply, proc, args, env):
+    """Apply memoized proc to args with apply(proc, args, env), unless its
+    output for args is cached."""
+    memo = proc.memo
+    key = memo.key(args)
+    if key is None:
+        return apply(proc, args, env)
+    value = memo.get(key)
+    if value is MISSING:
+        generation = memo.generation
+        value = apply(proc, args, env)
+        memo.put(key, value, generation)
+    return value
+
+def lookup(proc, args):
+    """Return the output of memoized proc cached for args, or MISSING, and a
+    (memo, key, generation) with which to cache its output once it is known,
+    or None if it cannot be cached.  The loops that make calls in tail
+    position use lookup rather than call, so that the calls do not nest."""
+    memo = proc.memo
+    key = memo.key(args)
+    if key is None:
+        return MISSING, None
+    return memo.get(key), (memo, key, memo.generation)
+
+def forget(name, env):
+    """Discard the outputs of procedures that might call the procedure called
+    name, which is being redefined.  Automatically memoized procedures are
+    compiled again, to check that they are still pure."""
+    names, seen = [name], set()
+    while names:
+        for proc in tuple(env.dependents.get(names.pop(), ())):
+            if proc in seen:
+                continue
+            seen.add(proc)
+            names.append(proc.name)
+            if proc.memo is not None:
+                proc.memo.clear()
+                if proc.memo.automatic:
+                    proc.memo = None
+                    proc.invalidate()
+
+##########
+# Purity #
+##########
+
+def detect(proc, env):
+    """Memoize a newly compiled procedure if env memoizes pure procedures
+    automatically and proc is pure."""
+    if env.auto_memoize and proc.memo is None and is_pure(proc, env):
+        proc.memo = Memo(automatic=True)
+
+def is_pure(proc, env, visiting=None):
+    """Return whether a procedure is pure.  Procedures that are being checked
+    further up the call chain are assumed to be pure.
+
+    >>> env = logo.Environment()
+    >>> [is_pure(env.procedures[name], env) for name in ['sum', 'print']]
+    [True, False]
+    """
+    if proc.isprimitive:
+        return proc.pure
+    if visiting is None:
+        visiting = set()
+    if proc in visiting:
+        return True
+    visiting.add(proc)
+    code = proc.code
+    if code is None:
+        code = logo_compiler.compile_procedure(proc, env)
+    params = set(proc.formal_params)
+    return all(is_pure_expression(expr, params, env, visiting)
+               for block in code for expr in block)
+
+def is_pure_expression(expr, params, env, visiting):
+    """Return whether evaluating a compiled expression in a procedure with
+    formal parameters params has no side effects."""
+    pure = lambda exprs: all(is_pure_expression(e, params, env, visiting)
+                             for e in exprs)
+    kind = type(expr)
+    if kind is logo_compiler.Constant:
+        return True
+    elif kind is logo_compiler.Lookup:
+        return expr.name in params
+    elif kind is logo_compiler.Call:
+        return is_pure(expr.proc, env, visiting) and pure(expr.operands)
+    elif kind is logo_compiler.Infix:
+        return is_pure(expr.proc, env, visiting) and \
+            pure([expr.left, expr.right])
+    elif kind is logo_compiler.TailCall:
+        return pure([expr.call])
+    elif kind is logo_compiler.Output:
+        return pure([expr.operand])
+    elif kind is logo_compiler.If:
+        return pure([expr.condition]) and pure(expr.block)
+    elif kind is logo_compiler.IfElse:
+        return pure([expr.condition]) and pure(expr.true_block) and \
+            pure(expr.false_block)
+    elif kind is logo_compiler.Repeat:
+        return pure([expr.count]) and pure(expr.block)
+    elif kind is logo_compiler.For:
+        local = params | {expr.name}
+        return pure(expr.limits) and all(
+            is_pure_expression(e, local, env, visiting) for e in expr.block)
+    elif kind is logo_compiler.While:
+        return pure([expr.condition]) and pure(expr.block)
+    elif kind in (logo_compiler.Run, logo_compiler.Condition,
+                  logo_compiler.Profiled):
+        return pure(expr.block)
+    return False # Definitions and expressions that fail
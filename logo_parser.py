@@ -1,17 +1,159 @@
 """The logo_parser module implements a parser for Logo."""
 
+import functools
+import math
+import re
 from buffer import Buffer
 
+##########
+# Tokens #
+##########
+
+class Token(str):
+    """A Logo token.  Tokens are strings, so they can be used anywhere the
+    parser used to return plain strings, but their type records what kind of
+    token the lexer found."""
+
+class Word(Token):
+    """A bare word, such as a procedure name, True, or False."""
+
+class Quoted(Token):
+    """A quoted word, such as "hello.  The text excludes the quote."""
+    def __new__(cls, s):
+        token = Token.__new__(cls, s)
+        token.text = s[1:]
+        return token
+
+class Variable(Token):
+    """A variable reference, such as :x.  The name excludes the colon."""
+    def __new__(cls, s):
+        token = Token.__new__(cls, s)
+        token.name = s[1:]
+        return token
+
+class Number(Token):
+    """A numeric literal.  The value is the number it denotes, or the text of
+    the literal if the number would not print as written, such as 007, or is
+    not finite, such as nan, which self-evaluates to its text."""
+    def __new__(cls, s, value):
+        token = Token.__new__(cls, s)
+        token.value = value
+        return token
+
+class Operator(Token):
+    """An infix operator or a parenthesis."""
+
+def make_token(symbol):
+    """Return a typed token for a symbol read from a line of Logo.
+
+    >>> [type(make_token(s)).__name__ for s in ['fd', '"a', ':x', '-5', '+']]
+    ['Word', 'Quoted', 'Variable', 'Number', 'Operator']
+    >>> make_token('2.5').value, make_token('2.50').value
+    (2.5, '2.50')
+    >>> make_token('nan').value, make_token('-inf').value
+    ('nan', '-inf')
+    """
+    if symbol in LOGO_OPERATORS:
+        return Operator(symbol)
+    if symbol.startswith('"'):
+        return Quoted(symbol)
+    if symbol.startswith(':'):
+        return Variable(symbol)
+    try:
+        value = int(symbol)
+    except ValueError:
+        try:
+            value = float(symbol)
+        except ValueError:
+            return Word(symbol)
+    if str(value) != symbol or not math.isfinite(value):
+        value = symbol
+    return Number(symbol, value)
+
+#########
+# Lexer #
+#########
+
+LOGO_OPERATORS = set('+-*/=<>()'[:])
+LOGO_DELIMITERS = set('[]\n '[:]).union(LOGO_OPERATORS)
+
+# One alternative per lexical rule of parse_line.  A "-" that starts the line
+# or follows a space begins a symbol (so -5 is a negative number); any other
+# "-" is the infix operator.
+_TOKEN_RE = re.compile(r"""
+    (?P<space> \ + )
+  | (?P<open> \[ )
+  | (?P<close> \] )
+  | (?P<symbol> (?<![^ ])-[^\[\]\n +\-*/=<>()]*
+              | [^ \[\]+\-*/=<>()][^\[\]\n +\-*/=<>()]* )
+  | (?P<operator> [-+*/=<>()] )
+""", re.VERBOSE)
+
+def tokenize(line):
+    """Convert a stripped line of Logo into nested lists of typed tokens in a
+    single pass over the line.
+
+    >>> tokenize('print sum 10 difference 7 3')
+    ['print', 'sum', '10', 'difference', '7', '3']
+    >>> tokenize('print [-1] 3 -1 3-1')
+    ['print', ['-', '1'], '3', '-1', '3', '-', '1']
+    """
+    stack, tokens = [], []
+    for match in _TOKEN_RE.finditer(line):
+        kind = match.lastgroup
+        if kind == 'space':
+            continue
+        elif kind == 'open':
+            stack.append(tokens)
+            tokens = []
+        elif kind == 'close':
+            if not stack:
+                break
+            stack[-1].append(tokens)
+            tokens = stack.pop()
+        else:
+            tokens.append(_make_token_cached(match.group()))
+    else:
+        if not stack:
+            return tokens
+    # Re-parse character by character to report the error as parse_line does.
+    parse_line(line, Buffer(line))
+    raise SyntaxError('Cannot parse ' + line)
+
+# Number of distinct lines whose tokens are cached by parse_line, and of
+# distinct words whose tokens are cached by tokenize.
+PARSE_CACHE_SIZE = 4096
+
+_make_token_cached = functools.lru_cache(maxsize=PARSE_CACHE_SIZE)(make_token)
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_cached(line):
+    return tokenize(line)
+
+##########
+# Parser #
+##########
+
 def parse_line(line, chars=None, depth=0):
     """Convert a single line of Logo into a list of tokens or lists.
 
+    Lines are tokenized in one pass and cached by their text.  Each call
+    returns new lists, so changing them does not change the cached tokens.
+    Passing a Buffer of characters as chars parses the line one character at a
+    time instead.
+
     >>> parse_line('print sum 10 difference 7 3')
     ['print', 'sum', '10', 'difference', '7', '3']
     >>> parse_line('print "this [is a [deep] list]')
     ['print', '"this', ['is', 'a', ['deep'], 'list']]
+    >>> parse_line('print "this [is a [deep] list]', Buffer('print "this [x]'))
+    ['print', '"this', ['x']]
+    >>> parse_line('print [a [b]]')[1][1].append('c')
+    >>> parse_line('print [a [b]]')
+    ['print', ['a', ['b']]]
     """
     if chars == None:
-        chars = Buffer(line.strip()[:])
+        return copy_lists(_parse_cached(line.strip()))
 
     tokens = []
     while True:
@@ -33,8 +175,9 @@ def parse_line(line, chars=None, depth=0):
         else:
             tokens.append(parse_token(chars))
 
-LOGO_OPERATORS = set('+-*/=<>()'[:])
-LOGO_DELIMITERS = set('[]\n '[:]).union(LOGO_OPERATORS)
+def copy_lists(tokens):
+    """Return a copy of nested lists of tokens, which are not copied."""
+    return [copy_lists(t) if type(t) is list else t for t in tokens]
 
 def parse_symbol(chars):
     """Parse the next symbol from a buffer chars, starting at chars.current."""
@@ -50,4 +193,3 @@ def parse_token(chars):
         if ch != '-' or chars.previous not in [' ', None]: # Negative numbers
             return chars.pop()
     return parse_symbol(chars)
-
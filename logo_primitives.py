@@ -3,47 +3,156 @@
 Note: Some additional primitive procedures are defined in logo.py.
 """
 
+import functools
+import itertools
 import operator as op
 import logo
-from buffer import Buffer
+import logo_core
+import logo_compiler
+import logo_turtle
+from logo_lists import islist, shared
+from logo_parser import make_token, Number
 
-try:
-    import turtle
-except Exception as e:
-    print('Cannot import turtle graphics:', e)
+turtle = None # The turtle module, imported when a turtle primitive is used
 
-def logo_print(x):
+# The turtle graphics backend: 'tk' for Python's turtle module, 'headless' for
+# a logo_turtle.Turtle, or 'auto' for tk only where there is a display.
+TURTLE_BACKENDS = ('auto', 'tk', 'headless')
+turtle_backend = 'auto'
+
+batch = None # The logo_turtle.Batch of commands for the turtle module
+
+def logo_print(x, env):
     """Implements Logo "print" primitive."""
-    logo.logo_type(x)
-    print('')
+    env.output.write(logo.render(x) + '\n')
 
-def logo_show(x):
+def logo_show(x, env):
     """Implements Logo "show" primitive."""
-    if type(x) == list:
-        print('[', end='')
-    logo.logo_type(x)
-    if type(x) == list:
-        print(']', end='')
-    print('')
+    text = logo.render(x)
+    if islist(x):
+        text = '[' + text + ']'
+    env.output.write(text + '\n')
 
 def repeat(n, exp, env):
-    """Implements "repeat", which evaluates an exp, n times."""
-    for _ in range(int(n)):
-        logo.eval_line(Buffer(exp), env)
+    """Implements "repeat", which evaluates an exp, n times.  The line is
+    compiled once, and "repcount" outputs the number of the current time.
+
+    >>> repeat(3, ['print', 'repcount'], logo.Environment())
+    1
+    2
+    3
+    """
+    n = to_int(n)
+    block = compile_body(exp, env)
+    outer = env.repcount
+    try:
+        for count in range(1, n + 1):
+            env.step()
+            env.repcount = count
+            logo_compiler.run_block(block, env)
+    finally:
+        env.repcount = outer
+    return None
+
+def logo_for(control, exp, env):
+    """Implements "for", which evaluates exp once for each value of a variable.
+    The control list holds the name of the variable followed by expressions
+    for its first value, its last value, and optionally the step between them.
+
+    >>> env = logo.Environment()
+    >>> logo_for(['i', '1', '2', '*', '3', '2'], ['type', ':i'], env)
+    135
+    """
+    name, limits = for_control(control)
+    block = logo_compiler.compile_line(limits, env)
+    values = for_values(*[expr.eval(env) for expr in block])
+    block = compile_body(exp, env)
+    env.push_frame({name: None}) # Bound once, and set for each value
+    try:
+        for value in values:
+            env.step()
+            env.set_variable_value(name, value)
+            logo_compiler.run_block(block, env)
+    finally:
+        env.pop_frame()
+    return None
+
+def logo_while(condition, exp, env):
+    """Implements "while", which evaluates exp as long as the line condition
+    outputs True."""
+    return loop('while', condition, exp, env)
+
+def logo_until(condition, exp, env):
+    """Implements "until", which evaluates exp until the line condition
+    outputs True."""
+    return loop('until', condition, exp, env)
+
+def loop(name, condition, exp, env):
+    """Evaluate exp while (or until) condition is True, compiling each once."""
+    test = compile_body(condition, env)
+    block = compile_body(exp, env)
+    stop = name == 'until'
+    while loop_condition(name, logo_compiler.run_block(test, env)) != stop:
+        env.step()
+        logo_compiler.run_block(block, env)
     return None
 
+def compile_body(exp, env):
+    """Compile a line run by a loop, so that it is prepared once per loop."""
+    return logo_compiler.compile_line(to_sequence(exp), env)
+
+def for_control(control):
+    """Return the variable name and the tokens of the limits in the control
+    list of a "for"."""
+    if not islist(control) or len(control) == 0 or islist(control[0]):
+        raise logo_core.error('First input to for must be [name start end]')
+    return to_word(control[0]), list(control[1:])
+
+def for_values(*limits):
+    """Return an iterator over the values of a "for" variable, from a first
+    value to a last value in steps of 1, -1, or a given step.
+
+    >>> list(for_values(1, 3)), list(for_values(3, 1, -2))
+    ([1, 2, 3], [3, 1])
+    >>> list(for_values(0, 1, 0.5))
+    [0, 0.5, 1.0]
+    """
+    if len(limits) not in (2, 3):
+        raise logo_core.error('First input to for must be [name start end]')
+    start, end = to_num(limits[0]), to_num(limits[1])
+    if len(limits) == 3:
+        step = to_num(limits[2])
+        if step == 0:
+            raise logo_core.error('The step of for must not be 0')
+    else:
+        step = 1 if end >= start else -1
+    def values(value):
+        while value <= end if step > 0 else value >= end:
+            yield value
+            value += step
+    return values(start)
+
+def loop_condition(name, val):
+    """Return whether the condition of a while or until loop is True."""
+    if val is True or val == 'True':
+        return True
+    elif val is False or val == 'False':
+        return False
+    message = 'First argument to "{0}" is not True or False: {1}'
+    raise logo_core.error(message.format(name, val))
+
 def logo_word(x, y):
     """Implements "word", which applies string addition and evaluation."""
-    if type(x) == list or type(y) == list:
-        raise logo.LogoError('Cannot take a sentence input.')
-    return x + y
+    if islist(x) or islist(y):
+        raise logo_core.LogoError('Cannot take a sentence input.')
+    return to_word(x) + to_word(y)
 
 def logo_sentence(x, y):
     """Implements "sentence", which builds a list (sentence) from two lists,
     converting non-list inputs to lists first."""
-    if type(x) != list:
+    if not islist(x):
         x = [x]
-    if type(y) != list:
+    if not islist(y):
         y = [y]
     return x + y
 
@@ -54,90 +163,466 @@ def logo_list(x, y):
 
 def logo_fput(x, y):
     """Implements "fput", which constructs a list (sentence) from an element
-    and the rest of the list."""
-    if type(y) != list:
-        raise logo.LogoError('Second input must be a sentence.')
-    return [x] + y
+    and the rest of the list, sharing the elements of the rest."""
+    if not islist(y):
+        raise logo_core.LogoError('Second input must be a sentence.')
+    return shared(y).fput(x)
+
+def logo_butfirst(x):
+    """Implements "butfirst", which shares the elements of a list."""
+    return to_sequence(shared(x))[1:]
+
+def logo_butlast(x):
+    """Implements "butlast", which shares the elements of a list."""
+    return to_sequence(shared(x))[:-1]
 
 def numeric(f):
     """Return a Logo primitive that has numeric inputs and output."""
     def coerced(*args):
-        result = f(*map(to_num, args))
-        if result is not None:
-            return str(result) 
+        return f(*map(to_num, args))
     return coerced
 
 def logical(f):
     """Return a Logo primitive that has boolean inputs and output."""
     def coerced(*args):
-        return str(f(*tuple(map(to_bool, args))))
+        return f(*map(to_bool, args))
     return coerced
 
 def to_num(s):
-    """Coerce string s to a number."""
-    try:
-        return int(s)
-    except (TypeError, ValueError):
+    """Coerce a number or a word s to a number.
+
+    >>> to_num(3), to_num('3'), to_num('2.50')
+    (3, 3, 2.5)
+    """
+    kind = type(s)
+    if kind is int or kind is float:
+        return s
+    elif kind is Number and type(s.value) is not str:
+        return s.value
+    elif kind is not bool:
         try:
-            return float(s)
+            return int(s)
         except (TypeError, ValueError):
-            raise logo.error(str(s) + ' is not a number')
+            try:
+                return float(s)
+            except (TypeError, ValueError):
+                pass
+    raise logo_core.error(str(s) + ' is not a number')
 
 def to_bool(s):
-    """Coerce string s to a bool."""
-    if s == 'True':
+    """Coerce a boolean or a word s to a bool."""
+    if s is True or s == 'True':
         return True
-    if s == 'False':
+    if s is False or s == 'False':
         return False
-    raise logo.error(str(s) + ' is not a boolean value')
+    raise logo_core.error(str(s) + ' is not a boolean value')
+
+def to_int(n):
+    """Coerce a repeat count n to an int.  Only whole numbers written without
+    a decimal point are counts."""
+    if type(n) is int:
+        return n
+    return int(str(n))
+
+def to_word(x):
+    """Return the word that prints as x, a number, a boolean, or a word."""
+    if isinstance(x, str):
+        return x
+    return str(x)
+
+def words_of(x):
+    """Return x, with every number and boolean in it replaced by a word."""
+    if islist(x):
+        return [words_of(item) for item in x]
+    return to_word(x)
 
 def equal(x, y):
-    """Return True if x and y are equal."""
-    if x == y:
-        return 'True'
+    """Return True if x and y are equal.  Numbers are equal if their values
+    are, and other values are equal if they print the same.
+
+    >>> equal(2, '2.0'), equal(True, 'True'), equal(1, True), equal([1], ['1'])
+    (True, True, False, True)
+    """
+    if islist(x) or islist(y):
+        return words_of(x) == words_of(y)
+    elif type(x) is bool or type(y) is bool:
+        return to_word(x) == to_word(y)
+    elif x == y:
+        return True
     try:
-        return str(float(x) == float(y))
+        return float(x) == float(y)
     except (TypeError, ValueError):
-        return 'False'
+        return False
+
+def to_sequence(x):
+    """Return x if it is a list or word, or the word that prints as x."""
+    if isinstance(x, str) or islist(x):
+        return x
+    return str(x)
+
+def isempty(x):
+    """Return whether x is an empty list or word."""
+    return (isinstance(x, str) or islist(x)) and len(x) == 0
+
+def logo_map(fn, data, env):
+    """Implements "map", which outputs the list of the outputs of fn, a
+    procedure name or a template, applied to each element of data.
+
+    >>> env = logo.Environment()
+    >>> logo_map(['?', '*', '2'], ['1', '2.5', 3], env)
+    [2, 5.0, 6]
+    >>> logo_map('first', [['a', 'b'], 'cd'], env)
+    ['a', 'c']
+    """
+    data = to_list(data)
+    proc = procedure_of(fn, 1, True, env)
+    vectorized = vectorize(proc, ARITHMETIC, env)
+    if vectorized is not None:
+        values = vectorized(data)
+        if values is not None:
+            return values
+    return [output_of(proc, [x], 'map', env, True) for x in data]
+
+def logo_filter(fn, data, env):
+    """Implements "filter", which outputs the elements of data for which fn, a
+    procedure name or a template, outputs True.
+
+    >>> logo_filter(['?', '>', '2'], ['1', '3', 5, 2], logo.Environment())
+    ['3', 5]
+
+    Each element is a step (see logo.Environment.step), so that limits stop
+    filters of long lists, on both the element-wise and vectorized paths.
+
+    >>> env = logo.Environment()
+    >>> env.step_limit = 100
+    >>> for fn in ['wordp', ['?', '>', '2']]:
+    ...     env.start_line()
+    ...     try:
+    ...         logo_filter(fn, logo_iseq(1, 5000), env)
+    ...     except logo_core.LogoError as e:
+    ...         print(e)
+    Stopped after 100 steps
+    Stopped after 100 steps
+    """
+    data = to_list(data)
+    proc = procedure_of(fn, 1, True, env)
+    vectorized = vectorize(proc, COMPARISONS, env)
+    if vectorized is not None:
+        keep = vectorized(data)
+        if keep is not None:
+            return list(itertools.compress(data, keep))
+    return [x for x in data
+            if to_bool(output_of(proc, [x], 'filter', env, True))]
+
+def logo_reduce(fn, data, env):
+    """Implements "reduce", which combines the elements of data with fn, a
+    procedure name or a template with two inputs, from right to left.
+
+    >>> env = logo.Environment()
+    >>> logo_reduce('sum', logo_iseq(1, 100), env)
+    5050
+    >>> logo_reduce(['word', '?1', '?2'], ['a', 'b', 'c'], env)
+    'abc'
+    """
+    data = to_list(data)
+    proc = procedure_of(fn, 2, True, env)
+    if len(data) == 0:
+        raise logo_core.error('reduce needs a nonempty list')
+    elif len(data) == 1:
+        return data[0]
+    if proc.name in COMBINED and \
+            logo_core.isprimitive_named(proc, proc.name):
+        values = numbers(data)
+        if values is not None: # Sums and products do not depend on order
+            env.step(len(values) - 1)
+            return functools.reduce(COMBINED[proc.name], reversed(values))
+    result = data[-1]
+    for x in reversed(data[:-1]):
+        result = output_of(proc, [x, result], 'reduce', env, True)
+    return result
+
+def logo_foreach(data, fn, env):
+    """Implements "foreach", which applies fn, a procedure name or a template,
+    to each element of data for its effect.
+
+    >>> logo_foreach(['a', 'b'], ['print', '?'], logo.Environment())
+    a
+    b
+    """
+    proc = procedure_of(fn, 1, False, env)
+    args = [env] if needs_env(proc) else []
+    for x in to_list(data):
+        env.step()
+        result = logo.logo_apply(proc, [x] + args)
+        if result is not None:
+            raise logo_core.error('You do not say what to do with {0}'.format(
+                words_of(result)))
+    return None
+
+def logo_iseq(first, last):
+    """Implements "iseq", which outputs the list of integers from first to
+    last."""
+    return list(range(to_int(first), to_int(last) + 1))
+
+def to_list(data):
+    """Return data if it is a list, or raise an error."""
+    if not islist(data):
+        raise logo_core.error('{0} is not a list'.format(data))
+    return data
+
+def needs_env(proc):
+    """Return whether applying proc requires the environment as an input."""
+    return proc.needs_env or not proc.isprimitive
+
+def output_of(proc, args, caller, env, step=False):
+    """Apply proc to args and return its output, which caller requires.
+
+    step: whether the application counts as a step (see logo.Environment.step).
+    """
+    if step:
+        env.step()
+    if needs_env(proc):
+        args = args + [env]
+    result = logo.logo_apply(proc, args)
+    if result is None:
+        raise logo_core.error('{0} did not output to {1}'.format(proc.name,
+                                                                 caller))
+    return result
+
+# Number of template procedures kept by each environment.
+TEMPLATE_CACHE_SIZE = 1024
+
+def procedure_of(fn, n, output, env):
+    """Return the procedure that fn, a procedure name or a template list,
+    refers to as a procedure with n inputs.
+
+    A template is a line in which ? (or ?1) stands for the first input and ?2
+    for the second.  It is made into a user-defined procedure, which outputs
+    the value of the line if output is True, and is kept in env.templates so
+    that it is compiled only once.  The TEMPLATE_CACHE_SIZE templates used
+    most recently are kept.
+
+    >>> env = logo.Environment()
+    >>> for i in range(TEMPLATE_CACHE_SIZE + 10):
+    ...     _ = procedure_of(['?', '+', str(i)], 1, True, env)
+    >>> len(env.templates) == TEMPLATE_CACHE_SIZE
+    True
+    """
+    if not islist(fn):
+        proc = env.procedures.get(to_word(fn), None)
+        if proc is None:
+            raise logo_core.error('I do not know how to {0}.'.format(fn))
+        if proc.arg_count != n:
+            raise logo_core.error('{0} takes {1} inputs, not {2}'.format(
+                fn, proc.arg_count, n))
+        return proc
+    key = (logo.render(fn), n, output)
+    templates = env.templates
+    proc = templates.get(key, None)
+    if proc is None:
+        body = [(['output'] if output else []) + template_line(fn)]
+        params = ['?' + str(i + 1) for i in range(n)]
+        proc = logo_core.Procedure('template', n, body, False, True, params)
+        templates[key] = proc
+        if len(templates) > TEMPLATE_CACHE_SIZE:
+            templates.popitem(last=False) # The least recently used
+    else:
+        templates.move_to_end(key)
+    return proc
+
+def template_line(tokens):
+    """Return a template line with each ? replaced by the variable :?1, and
+    each ?1 or ?2 by :?1 or :?2."""
+    line = []
+    for token in tokens:
+        if islist(token):
+            token = template_line(token)
+        elif token in ('?', '?1', '?2'):
+            token = make_token(':' + (token + '1')[:2])
+        line.append(token)
+    return line
+
+# Arithmetic and comparison primitives applied to whole lists of numbers by the
+# vectorized paths of map, filter, and reduce.
+ARITHMETIC = {'sum': op.add, 'difference': op.sub, 'product': op.mul,
+              'div': op.truediv}
+COMPARISONS = {'lessp': op.lt, 'greaterp': op.gt}
+COMBINED = {'sum': op.add, 'product': op.mul}
+
+def vectorize(proc, primitives, env):
+    """Return a function that applies a template procedure proc to a whole
+    list of numbers at once, or None if proc does not just output the value of
+    one of primitives applied to its input and numeric constants.  The function
+    returns None for a list that is not all numbers, or raises an error.
+    """
+    if proc.isprimitive or proc.formal_params != ['?1']:
+        return None
+    code = proc.code or logo_compiler.compile_procedure(proc, env)
+    if len(code) != 1 or len(code[0]) != 1 or \
+            type(code[0][0]) is not logo_compiler.Output:
+        return None
+    expr = code[0][0].operand
+    if type(expr) is logo_compiler.Infix:
+        operands = [expr.left, expr.right]
+    elif type(expr) is logo_compiler.Call:
+        operands = expr.operands
+    else:
+        return None
+    fn = primitives.get(expr.proc.name, None)
+    if fn is None or \
+            not logo_core.isprimitive_named(expr.proc, expr.proc.name):
+        return None # Not a vectorized primitive, or redefined by the user
+    constants = []
+    for operand in operands:
+        if type(operand) is logo_compiler.Lookup and operand.name == '?1':
+            constants.append(None)
+            continue
+        value = None
+        if type(operand) is logo_compiler.Constant:
+            value = numbers([operand.value])
+        if value is None:
+            return None
+        constants.append(value[0])
+    def apply(data):
+        values = numbers(data)
+        if values is None:
+            return None
+        outputs = []
+        for start in range(0, len(values), env.slice_steps):
+            chunk = values[start:start + env.slice_steps]
+            env.step(len(chunk)) # An element is a step, as on the other path
+            inputs = [chunk if value is None else itertools.repeat(value)
+                      for value in constants]
+            try:
+                outputs.extend(map(fn, *inputs))
+            except Exception:
+                return None # The element-wise path raises the same error
+        return outputs
+    return apply
+
+def numbers(data):
+    """Return the numbers that the elements of data coerce to, or None if they
+    are not all numbers.
+
+    >>> numbers(['1', 2.5, '007']), numbers(['1', 'a']), numbers([True])
+    ([1, 2.5, 7], None, None)
+    """
+    try:
+        return [x if type(x) is int or type(x) is float else to_num(x)
+                for x in data]
+    except logo_core.LogoError:
+        return None
 
 def load(make_primitive):
     """Extend the set of primitive Logo procedures."""
-    make_primitive('first', 1, lambda l: l[0])
-    make_primitive(['butfirst', 'bf'], 1, lambda l: l[1:])
-    make_primitive('last', 1, lambda l: l[-1])
-    make_primitive(['butlast', 'bl'], 1, lambda l: l[:-1])
-
-    make_primitive('sum', 2, numeric(op.add))
-    make_primitive('difference', 2, numeric(op.sub))
-    make_primitive('product', 2, numeric(op.mul))
-    make_primitive(['div', 'quotient'], 2, numeric(op.truediv))
-
-    make_primitive(['equalp', 'eq', 'equal?'], 2, equal)
-    make_primitive(['lessp', 'lt', 'less?'], 2, numeric(op.lt))
-    make_primitive(['greaterp', 'gp', 'greater?'], 2, numeric(op.gt))
-    make_primitive(['emptyp', 'empty?'], 1, lambda x: str(len(x) == 0))
-    make_primitive(['listp', 'list?'], 1, lambda x: str(type(x) == list))
-    make_primitive(['wordp', 'word?'], 1, lambda x: str(type(x) == str))
-
-    make_primitive('or', 2, logical(lambda x, y: bool(x or y)))
-    make_primitive('and', 2, logical(lambda x, y: bool(x and y)))
-    make_primitive('not', 1, logical(lambda x: not x))
-
-    make_primitive('print', 1, logo_print)
-    make_primitive('show', 1, logo_show)
+    make_primitive('first', 1, lambda l: to_sequence(l)[0], pure=True)
+    make_primitive(['butfirst', 'bf'], 1, logo_butfirst, pure=True)
+    make_primitive('last', 1, lambda l: to_sequence(l)[-1], pure=True)
+    make_primitive(['butlast', 'bl'], 1, logo_butlast, pure=True)
+
+    make_primitive('sum', 2, numeric(op.add), pure=True)
+    make_primitive('difference', 2, numeric(op.sub), pure=True)
+    make_primitive('product', 2, numeric(op.mul), pure=True)
+    make_primitive(['div', 'quotient'], 2, numeric(op.truediv), pure=True)
+
+    make_primitive(['equalp', 'eq', 'equal?'], 2, equal, pure=True)
+    make_primitive(['lessp', 'lt', 'less?'], 2, numeric(op.lt), pure=True)
+    make_primitive(['greaterp', 'gp', 'greater?'], 2, numeric(op.gt),
+                   pure=True)
+    make_primitive(['emptyp', 'empty?'], 1, isempty, pure=True)
+    make_primitive(['listp', 'list?'], 1, islist, pure=True)
+    make_primitive(['wordp', 'word?'], 1, lambda x: not islist(x), pure=True)
+
+    make_primitive('or', 2, logical(lambda x, y: x or y), pure=True)
+    make_primitive('and', 2, logical(lambda x, y: x and y), pure=True)
+    make_primitive('not', 1, logical(lambda x: not x), pure=True)
+
+    make_primitive('print', 1, logo_print, needs_env=True)
+    make_primitive('show', 1, logo_show, needs_env=True)
 
     make_primitive('repeat', 2, repeat, needs_env=True)
+    make_primitive('repcount', 0, lambda env: env.repcount, needs_env=True)
+    make_primitive('for', 2, logo_for, needs_env=True)
+    make_primitive('while', 2, logo_while, needs_env=True)
+    make_primitive('until', 2, logo_until, needs_env=True)
+
+    make_primitive('word', 2, logo_word, pure=True)
+    make_primitive(['sentence', 'se'], 2, logo_sentence, pure=True)
+    make_primitive('list', 2, logo_list, pure=True)
+    make_primitive('fput', 2, logo_fput, pure=True)
 
-    make_primitive('word', 2, logo_word)
-    make_primitive(['sentence', 'se'], 2, logo_sentence)
-    make_primitive('list', 2, logo_list)
-    make_primitive('fput', 2, logo_fput)
+    make_primitive('map', 2, logo_map, needs_env=True)
+    make_primitive('filter', 2, logo_filter, needs_env=True)
+    make_primitive('reduce', 2, logo_reduce, needs_env=True)
+    make_primitive('foreach', 2, logo_foreach, needs_env=True)
+    make_primitive('iseq', 2, logo_iseq, pure=True)
 
     load_turtle_graphics(make_primitive)
 
+def turtle_module():
+    """Return the turtle module, importing it the first time it is needed.
+
+    Importing turtle also imports tkinter, which takes longer than loading
+    the rest of the interpreter, so programs that never draw do not import it.
+    """
+    global turtle
+    if turtle is None:
+        if turtle_backend == 'headless' or (turtle_backend == 'auto' and
+                                            not logo_turtle.has_display()):
+            turtle = logo_turtle.Turtle()
+            return turtle
+        try:
+            import turtle as module
+        except Exception as e:
+            message = 'Cannot import turtle graphics: {0}'.format(e)
+            raise logo_core.LogoError(message)
+        turtle = module
+    return turtle
+
+def use_turtle(backend):
+    """Draw with backend (one of TURTLE_BACKENDS) from now on, discarding
+    any headless drawing."""
+    global turtle, turtle_backend
+    turtle, turtle_backend = None, backend
+
+def save_picture(path):
+    """Implements "savepicture", which writes the headless turtle's drawing
+    to path as SVG or PNG."""
+    if not isinstance(turtle_module(), logo_turtle.Turtle):
+        logo_core.error('Only headless turtle graphics (--turtle=headless) '
+                        'can be saved')
+    flush_turtle()
+    turtle.save(str(path))
+
+def turtle_batch():
+    """Return the Batch that queues commands for the turtle module."""
+    global batch
+    backend = turtle_module()
+    if batch is None or batch.backend is not backend:
+        batch = logo_turtle.Batch(backend)
+    return batch
+
+def flush_turtle():
+    """Draw the queued turtle commands and update the screen.  The read-eval
+    loop calls this whenever it is idle."""
+    if batch is not None:
+        batch.flush()
+
+def turtle_function(name):
+    """Return a function that applies turtle.name through the turtle batch,
+    importing turtle graphics when it is first applied."""
+    def apply(*args):
+        current = batch
+        if current is None or current.backend is not turtle:
+            current = turtle_batch()
+        return current.command(name, *args)
+    apply.__name__ = name
+    return apply
+
 def turtle_speed(n):
-    """Set turtle graphics to draw every n frames (default: 1)."""
-    turtle.tracer(n, 0)
+    """Set turtle graphics to draw every n frames, or to draw in batches if
+    n is 0 (the default)."""
+    turtle_batch().speed(n)
 
 def load_turtle_graphics(make_primitive):
     """Extend the set of primitive Logo procedures with turtle graphics.
@@ -145,20 +630,22 @@ def load_turtle_graphics(make_primitive):
     See http://docs.python.org/py3k/library/turtle.html for details on what
     these procedures do.
     """
-    make_primitive(['forward', 'fd'], 1, numeric(turtle.fd))
-    make_primitive(['backward', 'back', 'bk'], 1, numeric(turtle.bk))
-    make_primitive(['right', 'rt'], 1, numeric(turtle.rt))
-    make_primitive(['left', 'lt'], 1, numeric(turtle.lt))
-    make_primitive('circle', 1, numeric(turtle.circle))
-    make_primitive(['setpos', 'setposition', 'goto'], 2, numeric(turtle.goto))
-    make_primitive(['seth', 'setheading'], 1, numeric(turtle.seth))
-    make_primitive(['penup', 'pu'], 0, turtle.up)
-    make_primitive(['pendown', 'pd'], 0, turtle.down)
-    make_primitive(['showturtle', 'st'], 0, turtle.showturtle)
-    make_primitive(['hideturtle', 'ht'], 0, turtle.hideturtle)
-    make_primitive('clear', 0, turtle.clear)
-    make_primitive('color', 1, turtle.color)  # accepts strings, e.g., 'red'
-    make_primitive('begin_fill', 0, turtle.begin_fill)
-    make_primitive('end_fill', 0, turtle.end_fill)
-    make_primitive('exitonclick', 0, turtle.exitonclick)
+    t = turtle_function
+    make_primitive(['forward', 'fd'], 1, numeric(t('fd')))
+    make_primitive(['backward', 'back', 'bk'], 1, numeric(t('bk')))
+    make_primitive(['right', 'rt'], 1, numeric(t('rt')))
+    make_primitive(['left', 'lt'], 1, numeric(t('lt')))
+    make_primitive('circle', 1, numeric(t('circle')))
+    make_primitive(['setpos', 'setposition', 'goto'], 2, numeric(t('goto')))
+    make_primitive(['seth', 'setheading'], 1, numeric(t('seth')))
+    make_primitive(['penup', 'pu'], 0, t('up'))
+    make_primitive(['pendown', 'pd'], 0, t('down'))
+    make_primitive(['showturtle', 'st'], 0, t('showturtle'))
+    make_primitive(['hideturtle', 'ht'], 0, t('hideturtle'))
+    make_primitive('clear', 0, t('clear'))
+    make_primitive('color', 1, t('color'))  # accepts strings, e.g., 'red'
+    make_primitive('begin_fill', 0, t('begin_fill'))
+    make_primitive('end_fill', 0, t('end_fill'))
+    make_primitive('exitonclick', 0, t('exitonclick'))
     make_primitive('speed', 1, turtle_speed)
+    make_primitive('savepicture', 1, save_picture)
@@ -0,0 +1,342 @@
+"""The logo_profiler module measures where Logo programs spend their time.
+
+A Profiler counts the calls of each procedure and primitive, and the time
+spent in each: its self time excludes the procedures that it calls, and its
+total time includes them.  It also times each line of each user-defined
+procedure, keyed by the name of the procedure and the index of the line in its
+body, so that the hot lines of a program can be found.
+
+Profiling costs nothing while it is off.  Starting a profiler replaces the
+primitive procedures of an environment by timed copies and discards the
+compiled bodies of its procedures, which are compiled again with each line
+wrapped in a timed expression (see logo_compiler.Profiled).  Stopping it
+restores the primitives and compiles the bodies again without the timers.
+The compilers recognize timed copies as the primitives they time, so constant
+folding and vectorized templates (see logo_primitives) still apply while
+profiling; the primitive calls that they replace are not counted.
+
+Run a whole program with "python3 logo.py --profile FILE", or profile one line
+with the "profile" primitive:
+
+    ? profile [print fib 15]
+
+Timing every call slows down programs that make many small calls, and so
+distorts their profiles.  A Sampler instead records the Logo call stack of an
+environment at regular intervals from a background thread, at a cost that does
+not depend on the number of calls.  It writes the number of times each stack
+was seen as folded stacks, one "outer;inner count" line per stack, which
+flamegraph tools read.  Sampling is started and stopped by the "sample" and
+"unsample" primitives, by "python3 logo.py --sample OUT FILE", or by sending
+SIGUSR1 to a running interpreter.
+"""
+
+import collections
+import sys
+import threading
+import time
+
+import logo
+import logo_core
+import logo_primitives
+
+# The orders in which a report can list procedures, and the column that each
+# sorts on, largest first (or alphabetically for name).
+SORT_KEYS = ('self', 'total', 'calls', 'name')
+
+# The number of procedures and of lines that a report lists.
+REPORT_SIZE = 20
+
+class Stats(object):
+    """The number of calls of a procedure or a line and the time spent in it.
+
+    own: the time spent in it, excluding the procedures that it calls.
+
+    total: the time spent in it, including the procedures that it calls.  Time
+           spent in recursive calls is counted once.
+    """
+    __slots__ = ('calls', 'own', 'total')
+
+    def __init__(self):
+        self.calls = 0
+        self.own = self.total = 0.0
+
+class Profiler(object):
+    """Timings of the procedures and lines evaluated in an environment.
+
+    >>> ticks = iter(range(100))
+    >>> profiler = Profiler(clock=lambda: next(ticks))
+    >>> profiler.enter('f', 0)      # Line 0 of f starts at time 0
+    >>> profiler.enter('sum')       # and calls sum from time 1
+    >>> profiler.exit()             # to time 2.
+    >>> profiler.exit()             # The line ends at time 3.
+    >>> f, s = profiler.procedures['f'], profiler.procedures['sum']
+    >>> (f.calls, f.own, f.total), (s.calls, s.own, s.total)
+    ((1, 2.0, 3.0), (1, 1.0, 1.0))
+    """
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.procedures = dict() # Maps names to Stats
+        self.lines = dict() # Maps (name, index) pairs to Stats
+        self.sources = dict() # Maps (name, index) pairs to the text of lines
+        self.primitives = set() # The names of the profiled primitives
+        self.originals = dict() # Maps names to primitives replaced by copies
+        self._stack = [] # [name, index, start, time in callees] of each entry
+        self._active = dict() # Maps names and lines to entries on the stack
+
+    def enter(self, name, index=None):
+        """Start timing a primitive called name, or line index of the body of
+        the user-defined procedure called name."""
+        key = name if index is None else (name, index)
+        active = self._active
+        active[name] = active.get(name, 0) + 1
+        if index is not None:
+            active[key] = active.get(key, 0) + 1
+        self._stack.append([name, index, self.clock(), 0.0])
+
+    def exit(self):
+        """Stop timing the primitive or line that was entered last."""
+        name, index, start, inner = self._stack.pop()
+        elapsed = self.clock() - start
+        if self._stack:
+            self._stack[-1][3] += elapsed
+        self._count(self.procedures, name, name, index in (None, 0),
+                    elapsed, inner)
+        if index is not None:
+            self._count(self.lines, (name, index), (name, index), True,
+                        elapsed, inner)
+
+    def _count(self, table, key, active_key, call, elapsed, inner):
+        stats = table.get(key, None)
+        if stats is None:
+            stats = table[key] = Stats()
+        if call: # A procedure is called once for each time it starts line 0
+            stats.calls += 1
+        stats.own += elapsed - inner
+        self._active[active_key] -= 1
+        if not self._active[active_key]: # Not within a recursive call
+            stats.total += elapsed
+
+    def depth(self):
+        """Return the number of primitives and lines being timed."""
+        return len(self._stack)
+
+    def unwind(self, depth):
+        """Stop timing everything entered after depth entries, which an error
+        abandoned."""
+        while len(self._stack) > depth:
+            self.exit()
+
+    def report(self, sort='self', size=REPORT_SIZE):
+        """Return a table of the procedures that took the most time, sorted by
+        sort (one of SORT_KEYS), followed by a table of the hot lines.
+
+        >>> ticks = iter(range(100))
+        >>> profiler = Profiler(clock=lambda: next(ticks) / 1000)
+        >>> profiler.sources[('f', 0)] = 'print sum 1 2'
+        >>> profiler.primitives.add('sum')
+        >>> for name, index in [('f', 0), ('sum', None)]:
+        ...     profiler.enter(name, index)
+        >>> profiler.exit(); profiler.exit()
+        >>> print(profiler.report())
+            calls    self ms   total ms  procedure
+                1      2.000      3.000  f
+                1      1.000      1.000  sum (primitive)
+        <BLANKLINE>
+            calls    self ms   total ms  line
+                1      2.000      3.000  f:0  print sum 1 2
+        """
+        if sort not in SORT_KEYS:
+            logo_core.error('Cannot sort a profile by {0}'.format(sort))
+        def order(item):
+            key, stats = item
+            if sort == 'name':
+                return (str(key),)
+            column = {'self': stats.own, 'total': stats.total,
+                      'calls': stats.calls}[sort]
+            return (-column, str(key))
+        def table(heading, rows, label):
+            text = ['{0:>9} {1:>10} {2:>10}  {3}'.format(
+                'calls', 'self ms', 'total ms', heading)]
+            for key, stats in sorted(rows, key=order)[:size]:
+                text.append('{0:9} {1:10.3f} {2:10.3f}  {3}'.format(
+                    stats.calls, stats.own * 1000, stats.total * 1000,
+                    label(key)))
+            return '\n'.join(text)
+        def procedure(name):
+            if name in self.primitives:
+                return name + ' (primitive)'
+            return name
+        def line(key):
+            name, index = key
+            return '{0}:{1}  {2}'.format(name, index,
+                                         self.sources.get(key, ''))
+        return table('procedure', self.procedures.items(), procedure) + \
+            '\n\n' + table('line', self.lines.items(), line)
+
+#########################
+# Starting and stopping #
+#########################
+
+# The primitives that the compilers recognize, which are not replaced by timed
+# copies.
+CONTROL_PRIMITIVES = ('output', 'stop', 'if', 'ifelse', 'run', 'repeat', 'for',
+                      'while', 'until')
+
+def start(env):
+    """Start profiling env and return its Profiler."""
+    if env.profiler is not None:
+        logo_core.error('Already profiling')
+    profiler = env.profiler = Profiler()
+    control = {logo_core.PRIMITIVES[name] for name in CONTROL_PRIMITIVES}
+    if env.procedures is logo_core.PRIMITIVES:
+        env.procedures = dict(logo_core.PRIMITIVES)
+    timed = dict() # Maps primitives to their timed copies, shared by aliases
+    for name, proc in env.procedures.items():
+        if proc.isprimitive and proc not in control:
+            if proc not in timed:
+                timed[proc] = timed_primitive(proc, profiler)
+                profiler.primitives.add(proc.name)
+            profiler.originals[name] = proc
+            env.procedures[name] = timed[proc]
+    recompile(env)
+    return profiler
+
+def stop(env):
+    """Stop profiling env and return its Profiler."""
+    profiler = env.profiler
+    env.profiler = None
+    for name, original in profiler.originals.items():
+        proc = env.procedures.get(name, None)
+        if proc is not None and proc.isprimitive: # Not redefined meanwhile
+            env.procedures[name] = original
+    recompile(env)
+    return profiler
+
+def recompile(env):
+    """Discard the compiled bodies of the user-defined procedures of env."""
+    procs = list(env.procedures.values()) + list(env.templates.values())
+    for proc in procs:
+        if not proc.isprimitive:
+            proc.invalidate()
+
+def timed_primitive(proc, profiler):
+    """Return a copy of primitive proc whose calls are timed by profiler.
+
+    The compilers still recognize the copy as the primitive that it times.
+
+    >>> env = logo.Environment()
+    >>> timed = timed_primitive(env.procedures['sum'], Profiler())
+    >>> timed.body(1, 2), logo_core.isprimitive_named(timed, 'sum')
+    (3, True)
+    """
+    fn, name = proc.body, proc.name
+    enter, exit = profiler.enter, profiler.exit
+    def timed(*args):
+        enter(name)
+        try:
+            return fn(*args)
+        finally:
+            exit()
+    timed.__name__ = fn.__name__
+    copy = logo_core.Procedure(proc.name, proc.arg_count, timed, True,
+                               proc.needs_env, proc.formal_params, proc.pure)
+    copy.original = proc
+    return copy
+
+############
+# Sampling #
+############
+
+# The default number of seconds between samples.  Samples are taken no more
+# often than the interpreter thread lets the sampling thread run (see
+# sys.setswitchinterval).
+SAMPLE_INTERVAL = 0.005
+
+# The stack recorded when no procedure is being applied.
+TOPLEVEL = '(toplevel)'
+
+class Sampler(object):
+    """Counts the call stacks of an environment, sampled every interval
+    seconds from a background thread.
+
+    >>> env = logo.Environment()
+    >>> sampler = Sampler(env)
+    >>> sampler.sample()
+    >>> env.push_frame({}, logo_core.PRIMITIVES['sum'])
+    >>> sampler.sample(); sampler.sample()
+    >>> print(sampler.folded())
+    (toplevel) 1
+    sum 2
+    """
+    def __init__(self, env, path=None, interval=SAMPLE_INTERVAL):
+        self.env = env
+        self.path = path
+        self.interval = interval
+        self.counts = collections.Counter() # Maps folded stacks to samples
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a daemon thread."""
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='logo-sampler')
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Record the current call stack once."""
+        self.counts[';'.join(self.env.call_stack()) or TOPLEVEL] += 1
+
+    def stop(self):
+        """Stop sampling, and write the folded stacks to path if it is set."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.path is not None:
+            with open(self.path, 'w') as out:
+                out.write(self.folded() + '\n')
+
+    def folded(self):
+        """Return the sampled stacks as folded stack lines."""
+        return '\n'.join('{0} {1}'.format(stack, count)
+                         for stack, count in sorted(self.counts.items()))
+
+def start_sampling(env, path, interval=None):
+    """Start sampling env, writing folded stacks to path when stopped."""
+    if env.sampler is not None:
+        logo_core.error('Already sampling')
+    if interval is None:
+        interval = env.sample_interval
+    env.sampler = Sampler(env, path, interval)
+    env.sampler.start()
+    return env.sampler
+
+def stop_sampling(env):
+    """Stop sampling env, write its folded stacks, and return its Sampler."""
+    sampler = env.sampler
+    if sampler is None:
+        logo_core.error('Not sampling')
+    env.sampler = None
+    try:
+        sampler.stop()
+    except OSError as e:
+        logo_core.error('Cannot write {0}: {1}'.format(sampler.path, e))
+    return sampler
+
+def toggle_sampling(env, path):
+    """Start sampling env if it is not being sampled, or stop and report to
+    standard error otherwise.  Sent SIGUSR1, the interpreter calls this."""
+    try:
+        if env.sampler is None:
+            start_sampling(env, path)
+            message = 'Sampling to {0}'.format(path)
+        else:
+            sampler = stop_sampling(env)
+            message = 'Wrote {0} samples to {1}'.format(
+                sum(sampler.counts.values()), sampler.path)
+    except logo_core.LogoError as e:
+        message = str(e)
+    sys.stderr.write(message + '\n')
@@ -0,0 +1,91 @@
+"""The logo_scheduler module interleaves Logo programs cooperatively.
+
+An Environment yields after each slice of evaluation steps by calling its
+yield_hook (see Environment.step).  A Scheduler runs several programs in
+turns: each runs until it yields, and then the next program that has not
+finished runs.  Every program gets the same number of steps per turn, so a
+long program cannot keep the others from running, and the order in which they
+run depends only on the programs, not on the timing of threads.
+
+Each program runs in a thread of its own, but only the program whose turn it
+is runs; the others wait.  Threads are used to keep each program's Python
+stack while it waits, not to run programs at the same time.
+"""
+
+import threading
+
+import logo
+
+class Task(object):
+    """A program being run by a Scheduler: lines evaluated in env."""
+    def __init__(self, env, lines):
+        self.env = env
+        self.lines = lines
+        self.done = False
+
+class Scheduler(object):
+    """Runs programs in round-robin turns of a slice of steps each.
+
+    >>> scheduler = Scheduler()
+    >>> for word in ['a', 'b']:
+    ...     env = logo.Environment()
+    ...     env.slice_steps = 1 # Take turns after every step
+    ...     _ = scheduler.add(env, ['repeat 3 [type "' + word + ']'])
+    >>> scheduler.run()
+    ababab
+    """
+    def __init__(self):
+        self.tasks = []
+        self._turn = None # The Task that may run
+        self._changed = threading.Condition()
+
+    def add(self, env, lines):
+        """Add a program that evaluates lines, an iterable of strings, in env,
+        and return its Task.  Definitions read their bodies from lines."""
+        task = Task(env, iter(lines))
+        env.get_continuation_line = logo.generate_lines(task.lines, echo=False)
+        env.yield_hook = lambda env: self._yield(task)
+        self.tasks.append(task)
+        return task
+
+    def run(self):
+        """Run every program to its end, in turns."""
+        threads = [threading.Thread(target=self._run_task, args=(task,),
+                                    daemon=True) for task in self.tasks]
+        with self._changed:
+            self._turn = self.tasks[0] if self.tasks else None
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _run_task(self, task):
+        with self._changed:
+            self._changed.wait_for(lambda: self._turn is task)
+        env = task.env
+        try:
+            for line in task.lines:
+                try:
+                    logo.interpret_line(logo.strip_comment(line), env)
+                except (logo.LogoError, SyntaxError, RecursionError) as err:
+                    env.output.write('{0}\n'.format(err))
+                except EOFError: # A definition was not ended
+                    break
+        finally:
+            env.output.flush()
+            with self._changed:
+                task.done = True
+                self._pass_turn(task)
+
+    def _yield(self, task):
+        """Let the next program run, and wait for task's next turn."""
+        with self._changed:
+            self._pass_turn(task)
+            self._changed.wait_for(lambda: self._turn is task)
+
+    def _pass_turn(self, task):
+        """Give the turn to the next unfinished task after task."""
+        index = self.tasks.index(task)
+        order = self.tasks[index+1:] + self.tasks[:index+1]
+        self._turn = next((t for t in order if not t.done), None)
+        self._changed.notify_all()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+"""The logo_server module serves Logo sessions over TCP or a Unix socket.
+
+Usage: python3 logo_server.py [--host=HOST] [--port=PORT | --unix=PATH]
+                              [--workers=N] [--engine=ENGINE] [--memoize]
+                              [--step-limit=N] [--time-limit=SECONDS]
+
+Each connection is a session with its own Environment, which reads lines from
+the connection after a "?" prompt and writes what the program prints back to
+it, as the interactive interpreter does.  The lines of a definition ("to" to
+"end") are read from the connection after ">" prompts before the definition is
+evaluated.  Each session has its own table of procedures, which holds every
+primitive except those that write files on the server or start threads in it
+(see HOST_PRIMITIVES), and except turtle graphics: the interpreter has one
+turtle per process, which sessions would share, and which worker threads
+would drive at once.
+
+One event loop handles every connection, so that idle sessions cost little.
+Lines are evaluated by a pool of worker threads, so that a session running a
+long program does not stop the event loop from serving the others.  Errors in
+one session are reported to it and do not affect the rest.
+
+Threads keep sessions cheap and let them share the loaded interpreter, but
+they do not isolate sessions from each other: only one thread runs Python at
+a time, so CPU-bound sessions slow each other down, and a line that never
+ends would hold its worker for good.  Lines are therefore stopped after
+--step-limit steps or --time-limit seconds, which are finite by default.
+Worker processes would isolate sessions, at the cost of memory and of
+sending every line and its output between processes.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import sys
+
+import logo
+import logo_primitives
+from logo_parser import parse_line
+
+DEFAULT_PORT = 7007
+
+# The default limits on each line that a session evaluates.
+DEFAULT_STEP_LIMIT = 10 ** 7
+DEFAULT_TIME_LIMIT = 10
+
+# Primitives that sessions may not use, because they write files at paths
+# that the client chooses or start threads that sample the server's stacks.
+HOST_PRIMITIVES = {'sample', 'unsample', 'sampleinterval', 'savepicture'}
+
+class SessionStream(object):
+    """A file whose text is written to a connection by the event loop, so that
+    it can be written from a worker thread."""
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def write(self, text):
+        self.loop.call_soon_threadsafe(self.writer.write,
+                                       text.encode('utf-8'))
+
+    def flush(self):
+        pass
+
+class Session(object):
+    """A read-eval loop for one connection, reading from reader and writing
+    to writer."""
+    def __init__(self, reader, writer, pool, args):
+        self.reader, self.writer, self.pool = reader, writer, pool
+        self.loop = asyncio.get_running_loop()
+        self.output = logo.Output(SessionStream(self.loop, writer),
+                                  limit=logo.OUTPUT_BUFFER)
+        self.definition = [] # Lines read ahead for a definition
+        env = self.env = logo.Environment(self.continuation_line,
+                                          logo.ENGINES[args.engine],
+                                          self.output)
+        env.procedures = session_procedures()
+        env.max_depth = args.max_depth
+        env.auto_memoize = args.memoize
+        env.step_limit, env.time_limit = args.step_limit, args.time_limit
+
+    async def read_line(self, prompt):
+        """Prompt for a line and return it without its comment, or None at the
+        end of the connection."""
+        self.writer.write((prompt + ' ').encode('utf-8'))
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            return None
+        return logo.strip_comment(line.decode('utf-8', 'replace'))
+
+    async def serve(self):
+        """Read and evaluate lines until the connection ends or the user quits.
+        """
+        try:
+            while True:
+                line = await self.read_line('?')
+                if line is None or line.strip().lower() in {'quit', 'exit',
+                                                            'bye'}:
+                    break
+                if starts_definition(line) and \
+                        not await self.read_definition():
+                    break
+                await self.loop.run_in_executor(self.pool, self.interpret,
+                                                line)
+                await self.writer.drain()
+            self.writer.write(b'Goodbye!\n')
+            await self.writer.drain()
+        except (ConnectionError, EOFError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def read_definition(self):
+        """Read the lines of a definition up to "end" into self.definition,
+        and return whether they were all read.  A line that cannot be parsed
+        is read as part of the body, and reported when the definition is
+        evaluated.
+
+        >>> async def converse(text):
+        ...     args = parse_args(['--port', '0'])
+        ...     with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        ...         server = await start_server(args, pool)
+        ...         port = server.sockets[0].getsockname()[1]
+        ...         reader, writer = await asyncio.open_connection(
+        ...             '127.0.0.1', port)
+        ...         writer.write(text.encode('utf-8'))
+        ...         writer.write_eof()
+        ...         reply = await reader.read()
+        ...         server.close()
+        ...         await server.wait_closed()
+        ...         return reply.decode('utf-8')
+        >>> print(asyncio.run(converse('to f\\nprint [a]]\\nend\\nprint 1\\n')))
+        ? > > Unexpected "]" at [ p, r, i, n, t,  , [, a, ] >> ] ]
+        ? 1
+        ? Goodbye!
+        <BLANKLINE>
+        """
+        while True:
+            line = await self.read_line('>')
+            if line is None:
+                return False
+            self.definition.append(line)
+            try:
+                if parse_line(line) == ['end']:
+                    return True
+            except SyntaxError:
+                pass # Reported when the definition is evaluated
+
+    def continuation_line(self):
+        """Return the next line of a definition, which was read ahead."""
+        if not self.definition:
+            raise EOFError
+        return self.definition.pop(0)
+
+    def interpret(self, line):
+        """Evaluate a line in a worker thread, writing errors to the
+        session."""
+        try:
+            logo.interpret_line(line, self.env)
+        except (logo.LogoError, SyntaxError, RecursionError) as err:
+            self.output.write('{0}\n'.format(err))
+        except Exception as err:
+            self.output.write('Internal error: {0!r}\n'.format(err))
+        finally:
+            self.definition = []
+            self.output.flush()
+
+def session_procedures():
+    """Return a new table of the procedures that a session may use.
+
+    >>> table = session_procedures()
+    >>> 'print' in table, 'sample' in table, 'savepicture' in table
+    (True, False, False)
+    >>> 'forward' in table or 'fd' in table
+    False
+    """
+    excluded = HOST_PRIMITIVES | turtle_primitives()
+    return {name: proc for name, proc in logo.primitives().items()
+            if proc.name not in excluded}
+
+def turtle_primitives():
+    """Return the names of the turtle graphics primitives."""
+    names = set()
+    def collect(aliases, arg_count, fn, **kwds):
+        names.update([aliases] if type(aliases) == str else aliases)
+    logo_primitives.load_turtle_graphics(collect)
+    return names
+
+def starts_definition(line):
+    """Return whether line begins a definition, whose lines follow it.
+
+    >>> starts_definition('to square :x'), starts_definition('print "to')
+    (True, False)
+    """
+    try:
+        tokens = parse_line(line)
+    except SyntaxError:
+        return False
+    return bool(tokens) and tokens[0] == 'to'
+
+async def start_server(args, pool):
+    """Start serving sessions as args direct, each in a new Session."""
+    def connected(reader, writer):
+        return Session(reader, writer, pool, args).serve()
+    if args.unix is not None:
+        return await asyncio.start_unix_server(connected, path=args.unix)
+    return await asyncio.start_server(connected, args.host, args.port)
+
+async def serve_forever(args):
+    with concurrent.futures.ThreadPoolExecutor(args.workers) as pool:
+        server = await start_server(args, pool)
+        names = [str(s.getsockname()) for s in server.sockets]
+        sys.stderr.write('Serving Logo on {0}\n'.format(', '.join(names)))
+        async with server:
+            await server.serve_forever()
+
+def parse_args(argv):
+    """Parse the command line arguments of the server."""
+    parser = argparse.ArgumentParser(description='A Logo server.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='the address to listen on (default: '
+                             '%(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='the TCP port to listen on (default: '
+                             '%(default)s)')
+    parser.add_argument('--unix', metavar='PATH', default=None,
+                        help='listen on a Unix socket at PATH instead')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='threads that evaluate lines (default: '
+                             'chosen by Python)')
+    parser.add_argument('--engine', choices=sorted(logo.ENGINES),
+                        default='tree',
+                        help='evaluate expression trees, run bytecode, or '
+                             'call compiled Python closures')
+    parser.add_argument('--max-depth', type=int, default=logo.MAX_DEPTH,
+                        help='calls the vm and closure engines can nest '
+                             'before a stack overflow')
+    parser.add_argument('--memoize', action='store_true',
+                        help='cache the outputs of procedures that have no '
+                             'side effects')
+    parser.add_argument('--step-limit', metavar='N', type=int,
+                        default=DEFAULT_STEP_LIMIT,
+                        help='stop a line after N procedure calls and loop '
+                             'iterations (default: %(default)s)')
+    parser.add_argument('--time-limit', metavar='SECONDS', type=logo.positive,
+                        default=DEFAULT_TIME_LIMIT,
+                        help='stop a line after SECONDS (default: '
+                             '%(default)s)')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    try:
+        asyncio.run(serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
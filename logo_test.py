@@ -2,54 +2,297 @@
 
 """Unit testing framework for the Logo interpreter.
 
-Usage: python3 logo_test.py FILE
+Usage: python3 logo_test.py [--engine=ENGINE] [--memoize] [--jobs=N]
+                            [--json=OUT] [--force] [PATH ...]
 
-Interprets FILE as Logo source code, and compares each line of printed output to
-an expected output described in a comment.  For example,
+Interprets each test file as Logo source code, and compares each line of
+printed output to an expected output described in a comment.  For example,
 
 print 2+3
 ; expect 5
 
 Differences between printed and expected outputs are printed with line numbers.
+
+Each PATH is a test file or a directory, which is searched for .lg files
+(default: tests.lg).  Several files are run in parallel by a pool of worker
+processes, each file in its own Environment, and their results are merged into
+one summary.  --json writes the results as a machine-readable report to OUT
+(- for standard output).  The exit status is 1 if any test failed.
+
+The results of each file are cached in .logo_test_cache.json, keyed by a hash
+of the file, of the interpreter's sources, and of the options.  A file whose
+key has not changed is not run again, and its cached results are reported.
+--force runs every file.  Entries for files that no longer exist are evicted.
 """
 
+import argparse
+import concurrent.futures
+import glob
+import hashlib
 import io
+import json
+import os
 import sys
-from ucb import main
-from logo import Environment, read_eval_loop, strip_comment
-
-def summarize(output, expected_output):
-    """Summarize results of running tests."""
-    num_failed, num_expected = 0, len(expected_output)
-    for (actual, (expected, line_number)) in zip(output, expected_output):
-        if actual != expected:
-            num_failed += 1
-            print('test failed at line {0}'.format(line_number))
-            print('  expected: {0}'.format(expected))
-            print('   printed: {0}'.format(actual))
-    print('{0} tested; {1} failed.'.format(num_expected, num_failed))
+import time
+import traceback
+from logo import ENGINES, Environment, Output, read_eval_loop, strip_comment
 
 EXPECT_STRING = '; expect'
 
-@main
-def run_tests(src_file = 'tests.lg'):
-    """Run a read-eval loop that reads from src_file and collects outputs."""
+# The directory of the interpreter's sources, and the default cache file.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = '.logo_test_cache.json'
+
+def run_file(src_file='tests.lg', engine='tree', memoize=False):
+    """Run a read-eval loop that reads from src_file, compare its output with
+    the expected output, and return the results as a dict.
+
+    engine: the name of the engine that runs the file (a key of ENGINES).
+    """
     line_number, expected_output = 0, []
+    result = {'file': src_file, 'tested': 0, 'failed': 0, 'failures': [],
+              'error': None}
+    start = time.perf_counter()
+    try:
+        with open(src_file) as src:
+            def pop_line():
+                """Return the next line of src."""
+                nonlocal line_number
+                line_number += 1
+                line = src.readline()
+                if line.lstrip().startswith(EXPECT_STRING):
+                    expected = line.split(EXPECT_STRING, 1)[1][1:-1]
+                    expected_output.append((expected, line_number))
+                if not line:
+                    raise EOFError
+                return strip_comment(line)
+
+            printed = io.StringIO() # Collects output instead of stdout
+            env = Environment(pop_line, ENGINES[engine], Output(printed))
+            env.auto_memoize = memoize
+            read_eval_loop(env, pop_line)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    else:
+        output = printed.getvalue().split('\n')
+        for actual, (expected, number) in zip(output, expected_output):
+            if actual != expected:
+                result['failures'].append(
+                    {'line': number, 'expected': expected, 'printed': actual})
+        result['tested'] = len(expected_output)
+        result['failed'] = len(result['failures'])
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    return result
+
+def summarize(result):
+    """Print the failures of a file's tests and how many there were."""
+    for failure in result['failures']:
+        print('test failed at line {0}'.format(failure['line']))
+        print('  expected: {0}'.format(failure['expected']))
+        print('   printed: {0}'.format(failure['printed']))
+    if result['error'] is not None:
+        print('error running {0}:'.format(result['file']))
+        print(result['error'], end='')
+    print('{0} tested; {1} failed.{2}'.format(
+        result['tested'], result['failed'],
+        ' (cached)' if result.get('cached') else ''))
+
+def run_tests(src_file='tests.lg', engine='tree', memoize=False):
+    """Run the tests in src_file and print a summary of the results."""
+    result = run_file(src_file, engine, memoize)
+    summarize(result)
+    return result
+
+def find_tests(paths):
+    """Return the test files named by paths, finding the .lg files in
+    directories."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            files.extend(os.path.join(root, name)
+                         for name in sorted(names) if name.endswith('.lg'))
+    return files
+
+def run_all(files, engine='tree', memoize=False, jobs=None, cache=None,
+            force=False):
+    """Return the results of running each of files, in order, using up to
+    jobs worker processes (default: one per core).
+
+    cache: a ResultCache whose results are used for unchanged files, and which
+           records the results of the others.
+
+    force: whether to run every file, still recording results in cache.
+    """
+    results, keys = [None] * len(files), [None] * len(files)
+    options = engine + (' memoize' if memoize else '')
+    if cache is not None:
+        sources = source_hash()
+        for i, src_file in enumerate(files):
+            keys[i] = cache_key(src_file, sources, engine, memoize)
+            if not force:
+                results[i] = cache.get(src_file, options, keys[i])
+    stale = [f for f, result in zip(files, results) if result is None]
+    if jobs == 1 or len(stale) < 2:
+        fresh = [run_file(f, engine, memoize) for f in stale]
+    else:
+        n = len(stale)
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            fresh = list(pool.map(run_file, stale, [engine] * n,
+                                  [memoize] * n))
+    fresh.reverse()
+    for i, src_file in enumerate(files):
+        if results[i] is None:
+            results[i] = fresh.pop()
+            if cache is not None:
+                cache.put(src_file, options, keys[i], results[i])
+    return results
+
+###########
+# Caching #
+###########
+
+def source_hash():
+    """Return a hash of the Python sources of the interpreter."""
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(ROOT, '*.py'))):
+        with open(path, 'rb') as src:
+            digest.update(os.path.basename(path).encode() + b'\0')
+            digest.update(src.read() + b'\0')
+    return digest.hexdigest()
+
+def cache_key(src_file, sources, engine, memoize):
+    """Return the key of the results of src_file, which changes when the file,
+    the interpreter's sources (hashed as sources), or the options change, or
+    None if src_file cannot be read."""
+    digest = hashlib.sha256()
+    digest.update('{0} {1} {2}\0'.format(sources, engine, memoize).encode())
+    try:
+        with open(src_file, 'rb') as src:
+            digest.update(src.read())
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+class ResultCache(object):
+    """The results of test files, stored as JSON in a file at path and keyed
+    by the absolute paths of the test files and by the options that ran them.
+    """
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.entries = dict() # Maps paths to options to keys and results
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)['entries']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass # A missing or unreadable cache is empty
+
+    def get(self, src_file, options, key):
+        """Return the cached results of src_file run with options if its key
+        is key, marked as cached, or None."""
+        entry = self.entries.get(os.path.abspath(src_file), {}).get(options)
+        if key is None or entry is None or entry.get('key') != key:
+            return None
+        return dict(entry['result'], cached=True)
+
+    def put(self, src_file, options, key, result):
+        """Record the results of src_file run with options, unless it could
+        not be run."""
+        if key is not None and result['error'] is None:
+            entries = self.entries.setdefault(os.path.abspath(src_file), {})
+            entries[options] = {'key': key, 'result': result}
+
+    def save(self):
+        """Evict the entries of files that no longer exist, and write the
+        cache."""
+        self.entries = {path: entry for path, entry in self.entries.items()
+                        if os.path.exists(path)}
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'w') as f:
+                json.dump({'entries': self.entries}, f)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            sys.stderr.write('Cannot write {0}: {1}\n'.format(self.path, e))
+
+def report(results, engine, memoize, seconds):
+    """Return a machine-readable report of results as a dict."""
+    return {'engine': engine, 'memoize': memoize,
+            'seconds': round(seconds, 6), 'files': results,
+            'tested': sum(r['tested'] for r in results),
+            'failed': sum(r['failed'] for r in results),
+            'errors': sum(r['error'] is not None for r in results),
+            'cached': sum(bool(r.get('cached')) for r in results)}
+
+def print_report(summary):
+    """Print the results of several files and their totals."""
+    for result in summary['files']:
+        passed = not result['failed'] and result['error'] is None
+        print('{0} {1}  ({2} tested; {3} failed; {4})'.format(
+            'PASS' if passed else 'FAIL', result['file'], result['tested'],
+            result['failed'], 'cached' if result.get('cached') else
+            '{0:.3f}s'.format(result['seconds'])))
+        if not passed:
+            summarize(result)
+    print('{0} files ({1} cached); {2} tested; {3} failed; {4} errors in '
+          '{5:.3f}s.'.format(len(summary['files']), summary['cached'],
+                             summary['tested'], summary['failed'],
+                             summary['errors'], summary['seconds']))
+
+def parse_args(argv):
+    """Parse the command line arguments of the test runner."""
+    parser = argparse.ArgumentParser(description='Run Logo test files.')
+    parser.add_argument('paths', nargs='*', metavar='PATH',
+                        default=['tests.lg'],
+                        help='test files, or directories of .lg files '
+                             '(default: tests.lg)')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='tree',
+                        help='evaluate expression trees, run bytecode, or '
+                             'call compiled Python closures')
+    parser.add_argument('--memoize', action='store_true',
+                        help='cache the outputs of procedures that have no '
+                             'side effects')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='worker processes that run files in parallel '
+                             '(default: one per core)')
+    parser.add_argument('--json', metavar='OUT', default=None,
+                        help='write a machine-readable report to OUT '
+                             '(- for standard output)')
+    parser.add_argument('--force', action='store_true',
+                        help='run every file, ignoring cached results')
+    parser.add_argument('--cache', metavar='FILE', default=CACHE_FILE,
+                        help='the file of cached results (default: '
+                             '%(default)s)')
+    return parser.parse_args(argv)
+
+def run(*argv):
+    """Run the tests in files."""
+    args = parse_args(argv)
+    files = find_tests(args.paths)
+    start = time.perf_counter()
+    cache = ResultCache(args.cache)
+    results = run_all(files, args.engine, args.memoize, args.jobs, cache,
+                      args.force)
+    cache.save()
+    summary = report(results, args.engine, args.memoize,
+                     time.perf_counter() - start)
+    if args.json != '-':
+        if len(files) == 1:
+            summarize(results[0])
+        else:
+            print_report(summary)
+    if args.json is not None:
+        text = json.dumps(summary, indent=2) + '\n'
+        if args.json == '-':
+            sys.stdout.write(text)
+        else:
+            with open(args.json, 'w') as out:
+                out.write(text)
+    if summary['failed'] or summary['errors']:
+        sys.exit(1)
 
-    def pop_line(src = open(src_file)):
-        """Return the next line of src."""
-        nonlocal line_number
-        line_number += 1
-        line = src.readline()
-        if line.lstrip().startswith(EXPECT_STRING):
-            expected = line.split(EXPECT_STRING, 1)[1][1:-1]
-            expected_output.append((expected, line_number))
-        if not line:
-            raise EOFError
-        return strip_comment(line)
-
-    sys.stdout = io.StringIO()   # Substitute stdout to collect output
-    read_eval_loop(Environment(pop_line), pop_line) 
-    output = sys.stdout.getvalue().split('\n')
-    sys.stdout = sys.__stdout__  # Revert stdout
-    summarize(output, expected_output)
+if __name__ == '__main__':
+    run(*sys.argv[1:])
@@ -0,0 +1,535 @@
+"""The logo_turtle module draws turtle graphics without a display.
+
+The turtle primitives apply the functions of Python's turtle module, which
+needs a display and animates each segment as it is drawn.  A Turtle has the
+same functions, but records the segments, fills, and colors that it draws in a
+DisplayList, which can be written as an SVG drawing or as a PNG image that is
+rasterized and compressed here, without Tk.  The interpreter uses a Turtle when
+there is no display, or when it is run with --turtle=headless, and saves the
+drawing with the "savepicture" primitive or --save-drawing.
+"""
+
+import array
+import math
+import os
+import struct
+import sys
+import zlib
+
+import logo_core
+
+# The space left around the drawing in exported pictures.
+MARGIN = 10
+
+# The largest width or height of an exported PNG image; larger drawings are
+# scaled down to fit.
+MAX_PNG_SIZE = 4096
+
+# Color names that turtle graphics accepts, and their red, green, and blue.
+COLORS = {
+    'black': (0, 0, 0), 'white': (255, 255, 255), 'red': (255, 0, 0),
+    'green': (0, 128, 0), 'blue': (0, 0, 255), 'yellow': (255, 255, 0),
+    'cyan': (0, 255, 255), 'magenta': (255, 0, 255), 'orange': (255, 165, 0),
+    'purple': (128, 0, 128), 'brown': (165, 42, 42), 'pink': (255, 192, 203),
+    'gray': (128, 128, 128), 'grey': (128, 128, 128), 'gold': (255, 215, 0),
+    'navy': (0, 0, 128), 'violet': (238, 130, 238), 'lime': (0, 255, 0),
+    'maroon': (128, 0, 0), 'olive': (128, 128, 0), 'teal': (0, 128, 128),
+    'silver': (192, 192, 192), 'darkgreen': (0, 100, 0),
+    'lightblue': (173, 216, 230), 'darkblue': (0, 0, 139),
+    'darkred': (139, 0, 0), 'lightgreen': (144, 238, 144),
+    'lightgray': (211, 211, 211), 'lightgrey': (211, 211, 211),
+    'darkgray': (169, 169, 169), 'darkgrey': (169, 169, 169),
+}
+
+def has_display():
+    """Return whether turtle graphics can open a window on this system."""
+    if sys.platform in ('win32', 'darwin'):
+        return True
+    return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+def to_rgb(color):
+    """Return the red, green, and blue of a color name or #rrggbb color.
+
+    >>> to_rgb('Red'), to_rgb('#0080ff'), to_rgb('#fff')
+    ((255, 0, 0), (0, 128, 255), (255, 255, 255))
+    """
+    name = str(color).lower()
+    if name in COLORS:
+        return COLORS[name]
+    digits = name[1:]
+    if name.startswith('#') and len(digits) in (3, 6):
+        if len(digits) == 3:
+            digits = ''.join(d + d for d in digits)
+        try:
+            return tuple(int(digits[i:i+2], 16) for i in (0, 2, 4))
+        except ValueError:
+            pass
+    logo_core.error('Unknown color {0}'.format(color))
+
+class DisplayList(object):
+    """The segments and fills drawn by a turtle, in flat arrays.
+
+    points: the x0, y0, x1, y1 coordinates of each segment.
+
+    pens: the index in palette of the color of each segment.
+
+    fills: a (color index, segment count, vertices) triple for each filled
+           polygon, where the segment count is the number of segments drawn
+           before the fill began (which are drawn beneath it), and the vertices
+           are an array of x, y coordinates.
+
+    palette: the colors used, each once.
+    """
+    def __init__(self):
+        self.points = array.array('d')
+        self.pens = array.array('H')
+        self.fills = []
+        self.palette = []
+        self._indices = dict() # Maps colors to their indices in palette
+
+    def __len__(self):
+        return len(self.pens)
+
+    def color_index(self, color):
+        """Return the index of color in the palette, adding it if needed."""
+        index = self._indices.get(color, None)
+        if index is None:
+            index = self._indices[color] = len(self.palette)
+            self.palette.append(color)
+        return index
+
+    def add_segment(self, x0, y0, x1, y1, pen):
+        self.points.extend((x0, y0, x1, y1))
+        self.pens.append(pen)
+
+    def add_fill(self, pen, start, vertices):
+        self.fills.append((pen, start, vertices))
+
+    def clear(self):
+        self.__init__()
+
+    def bounds(self):
+        """Return the least and greatest x and y of everything drawn, which
+        include the origin."""
+        xs, ys = [0.0], [0.0]
+        for coords in [self.points] + [v for _, _, v in self.fills]:
+            xs.extend(coords[0::2])
+            ys.extend(coords[1::2])
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def layers(self):
+        """Yield ('fill', pen, vertices) and ('path', pen, polyline) items in
+        the order that they are painted.  Consecutive segments of one color
+        that join end to end are merged into a polyline of x, y coordinates."""
+        points, pens = self.points, self.pens
+        fills = sorted(self.fills, key=lambda fill: fill[1])
+        f = 0
+        polyline, current = None, None
+        for i in range(len(pens)):
+            while f < len(fills) and fills[f][1] <= i:
+                if polyline:
+                    yield 'path', current, polyline
+                    polyline = None
+                yield 'fill', fills[f][0], fills[f][2]
+                f += 1
+            x0, y0, x1, y1 = points[4*i:4*i+4]
+            if polyline and pens[i] == current and \
+                    (polyline[-2], polyline[-1]) == (x0, y0):
+                polyline.extend((x1, y1))
+            else:
+                if polyline:
+                    yield 'path', current, polyline
+                polyline, current = [x0, y0, x1, y1], pens[i]
+        if polyline:
+            yield 'path', current, polyline
+        for pen, _, vertices in fills[f:]:
+            yield 'fill', pen, vertices
+
+class Turtle(object):
+    """A turtle that records what it draws in a DisplayList.
+
+    Its functions are those of Python's turtle module that the turtle
+    primitives apply.  It starts at the origin facing east (heading 0), and
+    positive angles turn left.  It draws nothing on screen, so its commands
+    are not batched.
+
+    >>> t = Turtle()
+    >>> for _ in range(4):
+    ...     t.fd(10); t.lt(90)
+    >>> len(t.drawing), t.position()
+    (4, (0.0, 0.0))
+    >>> t.up(); t.goto(20, 0); t.down(); t.color('red'); t.bk(5)
+    >>> t.drawing.points[-4:].tolist(), t.drawing.palette
+    ([20.0, 0.0, 15.0, 0.0], ['black', 'red'])
+    """
+    animated = False
+
+    def __init__(self):
+        self.drawing = DisplayList()
+        self.reset()
+
+    def reset(self):
+        self.x = self.y = 0.0
+        self._heading = 0.0
+        self.pen_down = True
+        self.visible = True
+        self.pen = self.fill_pen = self.drawing.color_index('black')
+        self._fill = None # The vertices of the fill being drawn
+        self._fill_start = 0 # The number of segments drawn before the fill
+
+    def position(self):
+        return (round(self.x, 10) + 0.0, round(self.y, 10) + 0.0)
+
+    def heading(self):
+        return self._heading
+
+    def _move_to(self, x, y):
+        if self.pen_down:
+            self.drawing.add_segment(self.x, self.y, x, y, self.pen)
+        if self._fill is not None:
+            self._fill.extend((x, y))
+        self.x, self.y = x, y
+
+    def fd(self, distance):
+        radians = math.radians(self._heading)
+        self._move_to(self.x + distance * math.cos(radians),
+                      self.y + distance * math.sin(radians))
+
+    def bk(self, distance):
+        self.fd(-distance)
+
+    def lt(self, angle):
+        self._heading = (self._heading + angle) % 360
+
+    def rt(self, angle):
+        self.lt(-angle)
+
+    def seth(self, angle):
+        self._heading = angle % 360
+
+    def goto(self, x, y):
+        self._move_to(x, y)
+
+    def circle(self, radius):
+        """Draw a circle of radius as a polygon, as Python's turtle does: its
+        center is radius units to the left of the turtle."""
+        steps = 1 + int(min(11 + abs(radius) / 6, 59))
+        angle = 360 / steps
+        length = 2 * radius * math.sin(math.radians(angle / 2))
+        if radius < 0:
+            length, angle = -length, -angle
+        self.lt(angle / 2)
+        for _ in range(steps):
+            self.fd(length)
+            self.lt(angle)
+        self.lt(-angle / 2)
+
+    def up(self):
+        self.pen_down = False
+
+    def down(self):
+        self.pen_down = True
+
+    def showturtle(self):
+        self.visible = True
+
+    def hideturtle(self):
+        self.visible = False
+
+    def color(self, color):
+        """Set the colors of the pen and of fills."""
+        to_rgb(color)
+        self.pen = self.fill_pen = self.drawing.color_index(str(color))
+
+    def begin_fill(self):
+        self._fill = array.array('d', (self.x, self.y))
+        self._fill_start = len(self.drawing)
+
+    def end_fill(self):
+        if self._fill is not None and len(self._fill) >= 6:
+            self.drawing.add_fill(self.fill_pen, self._fill_start, self._fill)
+        self._fill = None
+
+    def clear(self):
+        """Erase the drawing, leaving the turtle where it is."""
+        pen = self.drawing.palette[self.pen]
+        self.drawing.clear()
+        self.pen = self.fill_pen = self.drawing.color_index(pen)
+        self._fill = None
+
+    def tracer(self, n=None, delay=None):
+        """Nothing is animated, so there is nothing to trace."""
+
+    def update(self):
+        """Nothing is displayed, so there is nothing to update."""
+
+    def exitonclick(self):
+        """There is no window to click."""
+
+    def save(self, path):
+        """Write the drawing to path, as SVG or PNG according to its
+        extension."""
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.svg':
+            data, mode = svg(self.drawing).encode('utf-8'), 'wb'
+        elif extension == '.png':
+            data, mode = png(self.drawing), 'wb'
+        else:
+            logo_core.error('Cannot save a drawing as {0}; use .svg or '
+                            '.png'.format(path))
+        try:
+            with open(path, mode) as out:
+                out.write(data)
+        except OSError as e:
+            logo_core.error('Cannot write {0}: {1}'.format(path, e))
+
+############
+# Batching #
+############
+
+class Batch(object):
+    """Turtle commands applied to a turtle graphics backend in batches.
+
+    Moves and turns are not applied when they are given.  They are queued as
+    the vertices of a polyline, in which consecutive turns are added together
+    and consecutive moves in one direction are merged.  The polyline is drawn
+    by moving the backend to each vertex in turn, when any other command is
+    applied or the batch is flushed.  Screen updates of the backend are
+    suspended, as by turtle.tracer(0), and the screen is updated once when the
+    batch is flushed: when the interpreter is idle, after clear, and before
+    exitonclick.  A program that sets its own speed is animated as it draws.
+    Commands for a backend that does not animate (whose animated attribute is
+    false, as for a Turtle) are applied at once.
+
+    >>> t = Turtle()
+    >>> t.animated = True # Batch the commands for this example
+    >>> batch = Batch(t)
+    >>> for _ in range(4):
+    ...     for name, arg in [('fd', 5), ('fd', 5), ('rt', 45), ('rt', 45)]:
+    ...         batch.command(name, arg)
+    >>> len(t.drawing), len(batch)
+    (0, 4)
+    >>> batch.flush()
+    >>> len(t.drawing), t.position(), t.heading()
+    (4, (0.0, 0.0), 0.0)
+    >>> batch.command('fd', 10); batch.flush(); batch.command('fd', 10)
+    >>> batch.command('up'); batch.command('fd', 10); batch.flush()
+    >>> len(t.drawing), t.position()
+    (6, (30.0, 0.0))
+    """
+    # Commands that only move or turn the turtle, which are queued.
+    QUEUED = {'fd', 'bk', 'lt', 'rt', 'goto', 'seth'}
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.automatic = True # Whether screen updates are suspended and batched
+        self.animated = getattr(backend, 'animated', True)
+        self._suspended = False
+        self._vertices = None # The x, y of each queued vertex, or None
+        self._x = self._y = self._heading = 0.0
+        self._direction = 0 # The sign of the last queued move, or 0 after a turn
+
+    def __len__(self):
+        """Return the number of queued vertices."""
+        return 0 if self._vertices is None else len(self._vertices) // 2
+
+    def command(self, name, *args):
+        """Apply the turtle function called name to args."""
+        if not (self.automatic and self.animated):
+            return getattr(self.backend, name)(*args)
+        if name in self.QUEUED:
+            self._queue(name, args)
+            return
+        self.draw()
+        self._suspend()
+        if name == 'exitonclick':
+            self.flush()
+        result = getattr(self.backend, name)(*args)
+        if name == 'clear':
+            self.flush()
+        return result
+
+    def _queue(self, name, args):
+        if self._vertices is None:
+            self._x, self._y = self.backend.position()
+            self._heading = self.backend.heading()
+            self._vertices = array.array('d')
+            self._direction = 0 # The last move was drawn, so cannot be merged
+            self._suspend()
+        vertices = self._vertices
+        if name in ('fd', 'bk'):
+            distance = args[0] if name == 'fd' else -args[0]
+            radians = math.radians(self._heading)
+            self._x += distance * math.cos(radians)
+            self._y += distance * math.sin(radians)
+            direction = 1 if distance >= 0 else -1
+            if direction == self._direction:
+                vertices[-2], vertices[-1] = self._x, self._y
+            else:
+                vertices.extend((self._x, self._y))
+            self._direction = direction
+            return
+        if name == 'goto':
+            self._x, self._y = args
+            vertices.extend((self._x, self._y))
+        elif name == 'seth':
+            self._heading = args[0] % 360
+        else:
+            angle = args[0] if name == 'lt' else -args[0]
+            self._heading = (self._heading + angle) % 360
+        self._direction = 0
+
+    def _suspend(self):
+        if not self._suspended:
+            self.backend.tracer(0)
+            self._suspended = True
+
+    def draw(self):
+        """Draw the queued polyline."""
+        vertices, self._vertices = self._vertices, None
+        if vertices is None:
+            return
+        goto = self.backend.goto
+        for i in range(0, len(vertices), 2):
+            goto(vertices[i], vertices[i+1])
+        self.backend.seth(self._heading)
+
+    def flush(self):
+        """Draw the queued polyline and update the screen."""
+        self.draw()
+        if self._suspended:
+            self.backend.update()
+
+    def speed(self, n):
+        """Update the screen every n frames, or batch updates if n is 0."""
+        self.flush()
+        self.automatic = n == 0
+        self._suspended = self.automatic
+        self.backend.tracer(n, 0)
+
+##########
+# Export #
+##########
+
+def svg(drawing):
+    """Return the drawing as the text of an SVG document.
+
+    >>> t = Turtle()
+    >>> t.fd(10); t.lt(90); t.fd(10.5)
+    >>> print(svg(t.drawing))  # doctest: +ELLIPSIS
+    <svg xmlns=... viewBox="-10 -20.5 30 30.5">
+    <rect x="-10" y="-20.5" width="30" height="30.5" fill="white"/>
+    <path d="M0 0L10 0L10 -10.5" stroke="black" fill="none" .../>
+    </svg>
+    """
+    min_x, min_y, max_x, max_y = drawing.bounds()
+    left, top = min_x - MARGIN, -max_y - MARGIN
+    width, height = max_x - min_x + 2 * MARGIN, max_y - min_y + 2 * MARGIN
+    box = 'x="{0}" y="{1}" width="{2}" height="{3}"'.format(
+        number(left), number(top), number(width), number(height))
+    lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{1}" '
+             'viewBox="{2} {3} {0} {1}">'.format(
+                 number(width), number(height), number(left), number(top)),
+             '<rect {0} fill="white"/>'.format(box)]
+    for kind, pen, coords in drawing.layers():
+        color = drawing.palette[pen]
+        xy = [(number(coords[i]), number(-coords[i+1]))
+              for i in range(0, len(coords), 2)]
+        if kind == 'fill':
+            lines.append('<polygon points="{0}" fill="{1}"/>'.format(
+                ' '.join(x + ',' + y for x, y in xy), color))
+        else:
+            lines.append('<path d="M{0}" stroke="{1}" fill="none" '
+                         'stroke-linecap="round" stroke-linejoin="round"/>'
+                         .format('L'.join(x + ' ' + y for x, y in xy), color))
+    lines.append('</svg>')
+    return '\n'.join(lines)
+
+def number(x):
+    """Format a coordinate with at most two decimal places.
+
+    >>> number(3.0), number(-0.001), number(2.345)
+    ('3', '0', '2.35')
+    """
+    text = '{0:.2f}'.format(x).rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+def png(drawing):
+    """Return the drawing as the bytes of a PNG image, one pixel per unit
+    (scaled down to MAX_PNG_SIZE), rasterized without anti-aliasing.
+
+    >>> t = Turtle()
+    >>> t.color('red'); t.begin_fill(); t.circle(20); t.end_fill()
+    >>> data = png(t.drawing)
+    >>> data[:8], struct.unpack('>II', data[16:24])
+    (b'\\x89PNG\\r\\n\\x1a\\n', (60, 60))
+    """
+    min_x, min_y, max_x, max_y = drawing.bounds()
+    scale = min(1.0, (MAX_PNG_SIZE - 2 * MARGIN) /
+                max(max_x - min_x, max_y - min_y, 1))
+    width = int(math.ceil((max_x - min_x) * scale)) + 2 * MARGIN
+    height = int(math.ceil((max_y - min_y) * scale)) + 2 * MARGIN
+    pixels = bytearray(b'\xff' * (width * height * 3))
+    def project(coords):
+        return [((coords[i] - min_x) * scale + MARGIN,
+                 (max_y - coords[i+1]) * scale + MARGIN)
+                for i in range(0, len(coords), 2)]
+    for kind, pen, coords in drawing.layers():
+        rgb = bytes(to_rgb(drawing.palette[pen]))
+        if kind == 'fill':
+            fill_polygon(pixels, width, height, project(coords), rgb)
+        else:
+            vertices = project(coords)
+            for (x0, y0), (x1, y1) in zip(vertices, vertices[1:]):
+                draw_line(pixels, width, height, x0, y0, x1, y1, rgb)
+    return encode_png(pixels, width, height)
+
+def draw_line(pixels, width, height, x0, y0, x1, y1, rgb):
+    """Set the pixels of a one pixel wide line from x0, y0 to x1, y1."""
+    x0, y0, x1, y1 = (int(round(v)) for v in (x0, y0, x1, y1))
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+    err = dx + dy
+    while True:
+        if 0 <= x0 < width and 0 <= y0 < height:
+            i = 3 * (y0 * width + x0)
+            pixels[i:i+3] = rgb
+        if x0 == x1 and y0 == y1:
+            return
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
+
+def fill_polygon(pixels, width, height, vertices, rgb):
+    """Set the pixels whose centers lie inside a polygon, by the even-odd
+    rule."""
+    edges = list(zip(vertices, vertices[1:] + vertices[:1]))
+    top = max(0, int(min(y for _, y in vertices)))
+    bottom = min(height - 1, int(max(y for _, y in vertices)))
+    for row in range(top, bottom + 1):
+        y = row + 0.5
+        crossings = sorted(x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+                           for (x0, y0), (x1, y1) in edges
+                           if (y0 <= y) != (y1 <= y))
+        for left, right in zip(crossings[0::2], crossings[1::2]):
+            start = max(0, int(math.ceil(left - 0.5)))
+            end = min(width - 1, int(math.floor(right - 0.5)))
+            if start <= end:
+                i, j = 3 * (row * width + start), 3 * (row * width + end + 1)
+                pixels[i:j] = rgb * (end + 1 - start)
+
+def encode_png(pixels, width, height):
+    """Return the bytes of a PNG image of rows of red, green, blue pixels."""
+    stride = 3 * width
+    rows = b''.join(b'\x00' + bytes(pixels[y*stride:(y+1)*stride])
+                    for y in range(height))
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + \
+        chunk(b'IDAT', zlib.compress(rows, 9)) + chunk(b'IEND', b'')